@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark of the message dispatch of the parser.
+
+Parses a synthetic conversation (see `synthetic`) in report mode with the
+handlers built by `FBParser.build_dispatch`, and prints the number of
+messages handled per second by `FBParser.process_msgs` for several data
+types selections.
+
+Examples
+--------
+    $ python benchmarks/bench_dispatch.py --msgs 500000
+
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from fbscraper.lib import FBDataTypes, FBParserMode  # noqa: E402
+from fbscraper.parser import FBParser  # noqa: E402
+from synthetic import make_convers_metadata, make_msgs  # noqa: E402
+
+
+def bench_dispatch(msgs, convers, participants, data, output):
+    """Parse `msgs` with the `data` types, return the elapsed time."""
+    parser = FBParser(None, json_msgs=msgs, mode=FBParserMode.REPORT,
+                      data=data, output=output, convers=convers,
+                      participants=participants)
+    parser.init_convers(msgs[0])
+    msg_functions, attach_handlers = parser.build_dispatch()
+    start = time.perf_counter()
+    parser.process_msgs(msg_functions, attach_handlers)
+    parser.close_reports()
+    elapsed = time.perf_counter() - start
+    parser.transport.close()
+    return elapsed
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--msgs", type=int, default=500000,
+                        help="Number of messages of the conversation")
+    args = parser.parse_args()
+
+    convers, participants = make_convers_metadata("1234")
+    msgs = list(make_msgs("1234", args.msgs))
+    print("[+] - Conversation of {} messages".format(args.msgs))
+    selections = [[FBDataTypes.ALL], [FBDataTypes.MESSAGES],
+                  [FBDataTypes.PICTURES, FBDataTypes.LINKS]]
+    for data in selections:
+        output = tempfile.mkdtemp() + os.sep
+        elapsed = bench_dispatch(msgs, convers, participants, data, output)
+        shutil.rmtree(output)
+        print("[+]     - {} : {:.2f} s, {:.0f} msgs/s".format(
+            " ".join(d.value for d in data), elapsed, args.msgs / elapsed))
+
+
+if __name__ == '__main__':
+    main()
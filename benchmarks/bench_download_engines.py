@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark of the download engines of DL mode.
+
+Downloads many small files from the local stand-in server (see `server`)
+with the threads engine (`FBParser.dl_file` inside a thread pool) and the
+asyncio engine (`FBAsyncDownloader`), and prints their throughput.
+
+Examples
+--------
+    $ python benchmarks/bench_download_engines.py --files 2000
+
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from fbscraper.parser import FBParser  # noqa: E402
+from fbscraper.transport import FBTransport  # noqa: E402
+from server import start_server  # noqa: E402
+
+
+def bench_threads(urls, output, threads):
+    """Download `urls` with the threads engine, return the elapsed time."""
+    parser = FBParser.__new__(FBParser)
+    parser.transport = FBTransport(pool_size=threads)
+    parser.quit = False
+    parser.rate_limiter = None
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        dl_futures = [executor.submit(parser.dl_file, url,
+                                      output + "t{}".format(i))
+                      for i, url in enumerate(urls)]
+        wait(dl_futures)
+    for future in dl_futures:
+        future.result()
+    parser.transport.close()
+    return time.perf_counter() - start
+
+
+def bench_async(urls, output, concurrency):
+    """Download `urls` with the asyncio engine, return the elapsed time."""
+    from fbscraper.aiodl import FBAsyncDownloader
+    downloader = FBAsyncDownloader(concurrency=concurrency,
+                                   limit_per_host=concurrency)
+    start = time.perf_counter()
+    dl_futures = [downloader.submit(url, output + "a{}".format(i))
+                  for i, url in enumerate(urls)]
+    wait(dl_futures)
+    for future in dl_futures:
+        future.result()
+    elapsed = time.perf_counter() - start
+    downloader.close()
+    return elapsed
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=2000,
+                        help="Number of files downloaded by each run")
+    parser.add_argument("--size", type=int, default=256 * 1024,
+                        help="Size in bytes of each file")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="Latency in seconds of the server")
+    parser.add_argument("--threads", type=int, nargs="+",
+                        default=[8, 64, 256],
+                        help="Numbers of threads of the threads engine")
+    parser.add_argument("--concurrency", type=int, nargs="+",
+                        default=[64, 256],
+                        help="Numbers of concurrent transfers of the "
+                             "asyncio engine (needs aiohttp)")
+    args = parser.parse_args()
+
+    server, base_url = start_server(args.size, args.latency)
+    urls = [base_url + "/m{}".format(i) for i in range(args.files)]
+    print("[+] - {} files of {} bytes, {} s latency".format(
+        args.files, args.size, args.latency))
+    for threads in args.threads:
+        output = tempfile.mkdtemp() + os.sep
+        elapsed = bench_threads(urls, output, threads)
+        shutil.rmtree(output)
+        print("[+]     - threads engine, {} threads : {:.2f} s, "
+              "{:.0f} files/s".format(threads, elapsed, args.files / elapsed))
+    for concurrency in args.concurrency:
+        output = tempfile.mkdtemp() + os.sep
+        elapsed = bench_async(urls, output, concurrency)
+        shutil.rmtree(output)
+        print("[+]     - async engine, {} transfers : {:.2f} s, {:.0f} "
+              "files/s".format(concurrency, elapsed, args.files / elapsed))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark of the assembly of the pages of a dumped conversation.
+
+Dumps synthetic conversations of increasing sizes (see `synthetic`) with
+`FBDumper.dump_convers`, whose pages are answered from memory instead of
+Facebook, and prints the time per message: it stays the same whatever the
+size when pages are assembled in linear time.
+
+Examples
+--------
+    $ python benchmarks/bench_dump_assembly.py --msgs 50000 100000 200000
+
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from bisect import bisect_left
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from fbscraper.dumper import FBDumper  # noqa: E402
+from synthetic import make_convers_metadata, make_msgs  # noqa: E402
+
+CONVERS_ID = "1234"
+USER_RAW_DATA = ("cookie:c_user=1\n__user:1\n__a:1\n__dyn:x\n__req:1\n"
+                 "fb_dtsg:x\n__rev:1\n")
+
+
+class FBStandInDumper(FBDumper):
+    """Dumper answering requests of pages from a list of messages.
+
+    Parameters
+    ----------
+    msgs : list
+        JSON formatted Facebook messages of the conversation, in
+        chronological order.
+    **kwargs
+        Arguments of `FBDumper`.
+
+    """
+
+    def __init__(self, msgs, **kwargs):
+        """__init__ method."""
+        self.msgs = msgs
+        self.timestamps = [m["timestamp"] for m in msgs]
+        super().__init__([CONVERS_ID], USER_RAW_DATA, **kwargs)
+
+    def get_all_convers_metadata(self):
+        """Return the metadata of the synthetic conversation."""
+        return make_convers_metadata(CONVERS_ID)
+
+    def make_request(self, url, data, to_stdout=False, verbose=False):
+        """Answer the page of messages sent before the timestamp cursor."""
+        timestamp = next(int(v) for k, v in data.items()
+                         if k.endswith("[timestamp]"))
+        end = bisect_left(self.timestamps, timestamp) if timestamp \
+            else len(self.msgs)
+        start = max(end - self.chunk_size, 0)
+        payload = {"actions": self.msgs[start:end]}
+        if start == 0:
+            payload[self._end_flag] = True
+        return {"payload": payload}
+
+
+def bench_dump(msgs, chunk_size, output):
+    """Dump `msgs` by pages of `chunk_size`, return the elapsed time."""
+    dumper = FBStandInDumper(msgs, chunk_size=chunk_size, timer=0,
+                             output=output)
+    start = time.perf_counter()
+    dumper.dump_convers(CONVERS_ID)
+    elapsed = time.perf_counter() - start
+    dumper.transport.close()
+    return elapsed
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--msgs", type=int, nargs="+",
+                        default=[50000, 100000, 200000, 400000],
+                        help="Numbers of messages of the conversations")
+    parser.add_argument("--chunk-size", type=int, default=2000,
+                        help="Number of messages of each page")
+    args = parser.parse_args()
+
+    print("[+] - Pages of {} messages".format(args.chunk_size))
+    for nb_msgs in args.msgs:
+        msgs = list(make_msgs(CONVERS_ID, nb_msgs))
+        output = tempfile.mkdtemp() + os.sep
+        elapsed = bench_dump(msgs, args.chunk_size, output)
+        shutil.rmtree(output)
+        print("[+]     - {} messages : {:.2f} s, {:.2f} us/msg".format(
+            nb_msgs, elapsed, elapsed / nb_msgs * 1e6))
+
+
+if __name__ == '__main__':
+    main()
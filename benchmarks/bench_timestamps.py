@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark of the formatting of message timestamps.
+
+Formats the timestamps of a synthetic conversation with `TimestampFormatter`
+and with `datetime.fromtimestamp(...).strftime(...)` for each timestamp,
+checks that both give the same strings and prints their throughput.
+
+Examples
+--------
+    $ python benchmarks/bench_timestamps.py --timestamps 1000000
+
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from fbscraper.lib import TimestampFormatter  # noqa: E402
+from synthetic import START_TIMESTAMP  # noqa: E402
+
+
+def format_with_strftime(timestamps):
+    """Format `timestamps` with `strftime`, return the formatted strings."""
+    return [datetime.fromtimestamp(t // 1000).strftime('%Y-%m-%d %H:%M:%S')
+            for t in timestamps]
+
+
+def format_with_formatter(timestamps):
+    """Format `timestamps` with `TimestampFormatter`, return the strings."""
+    timestamp_formatter = TimestampFormatter()
+    return [timestamp_formatter.format(t) for t in timestamps]
+
+
+def main():
+    """Run the benchmark."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--timestamps", type=int, default=1000000,
+                        help="Number of timestamps formatted")
+    parser.add_argument("--step", type=int, default=37000,
+                        help="Delay in ms between two timestamps")
+    args = parser.parse_args()
+
+    timestamps = [START_TIMESTAMP + i * args.step
+                  for i in range(args.timestamps)]
+    print("[+] - {} timestamps, one every {} ms".format(
+        args.timestamps, args.step))
+    results = []
+    for name, function in (("strftime", format_with_strftime),
+                           ("TimestampFormatter", format_with_formatter)):
+        start = time.perf_counter()
+        results.append(function(timestamps))
+        elapsed = time.perf_counter() - start
+        print("[+]     - {} : {:.2f} s, {:.0f} timestamps/s".format(
+            name, elapsed, args.timestamps / elapsed))
+    if results[0] != results[1]:
+        raise ValueError("TimestampFormatter and strftime results differ")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""server module.
+
+This module contains a local HTTP server standing in for the Facebook CDN
+in benchmarks. Every path is answered with the same body, after a fixed
+latency, with keep-alive connections and `Range` support.
+
+Examples
+--------
+>>> from server import start_server
+>>> server, base_url = start_server(size=256 * 1024, latency=0.05)
+>>> url = base_url + "/picture.jpg"
+>>> server.shutdown()
+
+"""
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+
+class FBStandInHandler(BaseHTTPRequestHandler):
+    """Request handler of the stand-in server."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        """Do not log requests."""
+
+    def do_HEAD(self):
+        """Answer the size of the body."""
+        time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.server.body)))
+        self.end_headers()
+
+    def do_GET(self):
+        """Answer the body, or its requested range."""
+        time.sleep(self.server.latency)
+        body = self.server.body
+        range_header = self.headers.get("Range")
+        if range_header:
+            start = int(range_header.split("=")[1].split("-")[0])
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(
+                start, len(body) - 1, len(body)))
+            body = body[start:]
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_server(size=256 * 1024, latency=0.05):
+    """Start the stand-in server inside a background thread.
+
+    Parameters
+    ----------
+    size : int, optional
+        Size in bytes of the body of every file. The default is 256 KiB.
+    latency : float, optional
+        Delay in seconds before answering each request. The default is
+        0.05.
+
+    Returns
+    -------
+    tuple
+        Containing the server and its base URL (server, base_url). Stop it
+        with `server.shutdown()`.
+
+    """
+    ThreadingHTTPServer.request_queue_size = 1024
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FBStandInHandler)
+    server.daemon_threads = True
+    server.body = b"x" * size
+    server.latency = latency
+    Thread(target=server.serve_forever, daemon=True).start()
+    return (server, "http://127.0.0.1:{}".format(server.server_address[1]))
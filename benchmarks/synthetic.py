@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""synthetic module.
+
+This module builds synthetic conversations for benchmarks: JSON formatted
+Facebook messages, and the conversation metadata, with a realistic mix of
+texts, pictures, GIFs, videos, files and shared links.
+
+Examples
+--------
+>>> from synthetic import make_convers_metadata, make_msgs
+>>> convers, participants = make_convers_metadata("1234")
+>>> msgs = list(make_msgs("1234", 500000))
+
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from fbscraper.lib import FBConversType  # noqa: E402
+
+START_TIMESTAMP = 1500000000000
+
+
+def make_convers_metadata(convers_id):
+    """Build the metadata of a synthetic conversation between two users.
+
+    Parameters
+    ----------
+    convers_id : str
+        Conversation ID.
+
+    Returns
+    -------
+    tuple
+        Containing the conversations metadata and the participants, like
+        `FBDumper` (convers, participants).
+
+    """
+    convers = {convers_id: {"type": FBConversType.USER, "name": "Bob",
+                            "status": "inbox",
+                            "participants": ["fbid:100", "fbid:200"],
+                            "last_message_timestamp": START_TIMESTAMP}}
+    return (convers, {"100": "Alice", "200": "Bob"})
+
+
+def make_msgs(convers_id, nb_msgs, start=START_TIMESTAMP, step=60000):
+    """Generate the messages of a synthetic conversation.
+
+    Parameters
+    ----------
+    convers_id : str
+        Conversation ID.
+    nb_msgs : int
+        Number of messages.
+    start : int, optional
+        Timestamp (in ms) of the first message.
+    step : int, optional
+        Delay in ms between two messages. The default is one minute.
+
+    Yields
+    ------
+    dict
+        JSON formatted Facebook message, from the oldest.
+
+    """
+    for i in range(nb_msgs):
+        attachments = []
+        if i % 10 == 0:
+            attachments.append({"attach_type": "photo",
+                                "name": "p{}.jpg".format(i),
+                                "preview_url": "https://cdn/p{}.jpg"
+                                               .format(i),
+                                "url": None})
+        if i % 97 == 0:
+            attachments.append({"attach_type": "video",
+                                "name": "v{}.mp4".format(i),
+                                "url": "https://cdn/v{}.mp4".format(i),
+                                "preview_url": None})
+        if i % 31 == 0:
+            attachments.append({"attach_type": "animated_image",
+                                "name": "g{}.gif".format(i),
+                                "preview_url": "https://cdn/g{}.gif"
+                                               .format(i),
+                                "url": None})
+        if i % 53 == 0:
+            attachments.append({"attach_type": "file",
+                                "name": "f{}.pdf".format(i),
+                                "url": "https://cdn/f{}.pdf".format(i),
+                                "preview_url": None})
+        if i % 23 == 0:
+            attachments.append({"attach_type": "share", "name": "share",
+                                "share": {"uri": "https://l.facebook.com/"
+                                                 "l.php?u=https%3A%2F%2F"
+                                                 "example.com%2F{}&h=x"
+                                                 .format(i)}})
+        yield {"action_type": "ma-type:user-generated-message"
+                              if i % 100 else "ma-type:log-message",
+               "author": "fbid:100" if i % 2 else "fbid:200",
+               "body": "Message number {} of the conversation".format(i),
+               "timestamp": start + i * step,
+               "message_id": "mid.{}.{}".format(convers_id, i),
+               "other_user_fbid": convers_id, "thread_fbid": None,
+               "attachments": attachments}
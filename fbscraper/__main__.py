@@ -11,6 +11,8 @@ Examples
         $ ./fbscraper.py dumper -s 10000 -c request_data.txt
         $ ./fbscraper.py parser -m dl -d all -i output/*/complete.json
         -c request_data.txt
+        $ ./fbscraper.py pipeline -m dl -d pictures -c request_data.txt
+        $ ./fbscraper.py search '"happy birthday"' --since 2016-01-01
 
     Using as the module:
         >>> from fbscraper.parser import FBParser
@@ -19,14 +21,21 @@ Examples
 
 """
 import argparse
+import os
 import sys
+import time
+from datetime import datetime
 
+from fbscraper.db import FBDatabase
 from fbscraper.dumper import FBDumper
-from fbscraper.lib import FBDataTypes, FBParserMode, FBResponseError, \
-                           OUTPUT_DEFAULT_FOLDER, \
-                           format_convers_metadata, \
+from fbscraper.lib import FBCompression, FBDataTypes, FBDownloadEngine, \
+                           FBParserMode, FBResponseError, \
+                           OUTPUT_DEFAULT_FOLDER, STORE_DEFAULT_FOLDER, \
+                           SEARCH_INDEX_DEFAULT_FILENAME, \
+                           TimestampFormatter, format_convers_metadata, \
                            build_fmt_str_from_enum
 from fbscraper.parser import FBParser
+from fbscraper.search import FBSearchIndex
 
 
 def check_positive_int(value):
@@ -56,12 +65,23 @@ def check_positive_float(value):
     return fvalue
 
 
+def check_date(value):
+    """Check date formatted as YYYY-MM-DD, return its timestamp in ms."""
+    try:
+        date = datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError("{} is an invalid YYYY-MM-DD "
+                                         "date".format(value))
+    return int(date.timestamp() * 1000)
+
+
 def main():
     """Main function.
 
     This method will parse arguments and depending on which tool is selected
-    (**dumper** or **parser**) and executed the corresponding main function
-    (`dumper_tool_main` or `parser_tool_main`).
+    (**dumper**, **parser**, **pipeline** or **search**) and executed the
+    corresponding main function (`dumper_tool_main`, `parser_tool_main`,
+    `pipeline_tool_main` or `search_tool_main`).
 
     Returns
     -------
@@ -72,6 +92,8 @@ def main():
     --------
     dumper_tool_main : method executed for the **dumper** tool.
     parser_tool_main : method executed for the **parser** tool.
+    pipeline_tool_main : method executed for the **pipeline** tool.
+    search_tool_main : method executed for the **search** tool.
 
     Notes
     -----
@@ -87,14 +109,13 @@ def main():
                                           'See help: fbscraper dumper -h')
     parser_parser = subparsers.add_parser('parser', help='Parser tool. '
                                           'See help: fbscraper parser -h')
-
-    dumper_parser.add_argument('-id', "--convers-id", nargs='*',
-                               help="Conversation IDs to dump")
-
-    dumper_parser.add_argument('-s', "--size", type=check_positive_int,
-                               default=2000,
-                               help="Number of messages to retrieve for "
-                                    "each request")
+    pipeline_parser = subparsers.add_parser('pipeline', help='Dumper and '
+                                            'parser tools streaming '
+                                            'messages from one to the '
+                                            'other. See help: fbscraper '
+                                            'pipeline -h')
+    search_parser = subparsers.add_parser('search', help='Search tool. '
+                                          'See help: fbscraper search -h')
 
     dumper_parser.add_argument('-off', "--offset", type=check_positive_int,
                                default=0,
@@ -104,38 +125,213 @@ def main():
                                default=1,
                                help="Do not retrieve the last 'n' messages'")
 
+    dumper_parser.add_argument('-w', "--workers",
+                               type=check_positive_and_not_zero_int, default=1,
+                               help="Number of conversations dumped "
+                                    "concurrently. The --timer is shared "
+                                    "by all workers")
+
+    dumper_parser.add_argument('-inc', "--incremental", action="store_true",
+                               help="Only retrieve messages newer than the "
+                                    "ones already dumped inside the --output "
+                                    "folder. Conversations without new "
+                                    "messages are skipped")
+
+    dumper_parser.add_argument('-r', "--resume", action="store_true",
+                               help="Resume interrupted dumps from their "
+                                    "last checkpoint")
+
     dumper_parser.add_argument('-meta', '--metadata', action="store_true",
                                help="If this option is used, conversations "
                                     " not dumped. Conversations metadata "
                                     "are printed")
 
-    parser_parser.add_argument('-m', '--mode', required=True,
+    for subparser in [dumper_parser, pipeline_parser]:
+        subparser.add_argument('-id', "--convers-id", nargs='*',
+                               help="Conversation IDs to dump")
+
+        subparser.add_argument('-s', "--size", type=check_positive_int,
+                               default=2000,
+                               help="Number of messages to retrieve for "
+                                    "each request")
+
+        subparser.add_argument('-p', "--pretty", action="store_true",
+                               help="Also save a 'pretty' JSON dump "
+                                    "(complete.pretty.json) for each "
+                                    "conversation")
+
+        subparser.add_argument('-z', "--compress", type=FBCompression,
+                               default=FBCompression.NONE,
+                               help="Compression used for JSON dumps. "
+                                    "COMPRESS may be one of "
+                                    + build_fmt_str_from_enum(FBCompression))
+
+        subparser.add_argument("--since", type=check_date,
+                               help="Only dump messages sent from this "
+                                    "YYYY-MM-DD date, older messages are "
+                                    "not requested")
+
+        subparser.add_argument("--until", type=check_date,
+                               help="Only dump messages sent before this "
+                                    "YYYY-MM-DD date, newer messages are "
+                                    "not requested")
+
+        subparser.add_argument("--db",
+                               help="SQLite database where to also save "
+                                    "messages and attachments, with indexes "
+                                    "(see the parser --db option)")
+
+    parser_parser.add_argument("-i", "--infile", nargs='+',
+                               help="File to parse and try to retrieve data "
+                                    "from the --data types")
+
+    parser_parser.add_argument('-p', "--processes",
+                               type=check_positive_and_not_zero_int, default=1,
+                               help="Number of processes parsing --infile "
+                                    "files concurrently")
+
+    parser_parser.add_argument("--db",
+                               help="SQLite database saved by the dumper "
+                                    "--db option, from where to parse every "
+                                    "conversation instead of --infile files")
+
+    parser_parser.add_argument("--since", type=check_date,
+                               help="Only parse messages sent from this "
+                                    "YYYY-MM-DD date")
+
+    parser_parser.add_argument("--until", type=check_date,
+                               help="Only parse messages sent before this "
+                                    "YYYY-MM-DD date")
+
+    parser_parser.add_argument("--offline", action="store_true",
+                               help="Only use the conversations metadata "
+                                    "cache saved inside the --output folder. "
+                                    "The --cookie option is then optional")
+
+    for subparser in [parser_parser, pipeline_parser]:
+        subparser.add_argument('-m', '--mode', required=True,
                                type=FBParserMode,
                                help="Report mode only save URLs inside files. "
                                     "The dl mode additionnaly download it. "
                                     "MODE may be one of "
                                     + build_fmt_str_from_enum(FBParserMode))
 
-    parser_parser.add_argument("-d", "--data", nargs="+",
+        subparser.add_argument("-d", "--data", nargs="+",
                                type=FBDataTypes,
                                default=[FBDataTypes.ALL],
                                help="Data to retrieve from the --infile file. "
                                     "DATA may be one or many of "
                                     + build_fmt_str_from_enum(FBDataTypes))
 
-    parser_parser.add_argument("-i", "--infile", nargs='+',
-                               help="File to parse and try to retrieve data "
-                                    "from the --data types")
-
-    parser_parser.add_argument('-t', "--threads",
+        subparser.add_argument('-t', "--threads",
                                type=check_positive_and_not_zero_int, default=4,
                                help="Number of threads for dl mode")
 
+        subparser.add_argument('-e', "--engine", type=FBDownloadEngine,
+                               default=FBDownloadEngine.THREADS,
+                               help="Download engine for dl mode. With the "
+                                    "async engine, --threads is the number "
+                                    "of concurrent transfers. ENGINE may be "
+                                    "one of "
+                                    + build_fmt_str_from_enum(
+                                        FBDownloadEngine))
+
+        subparser.add_argument("--per-host",
+                               type=check_positive_and_not_zero_int,
+                               default=16,
+                               help="Maximum number of connections to the "
+                                    "same host for the async engine")
+
+        subparser.add_argument("--queue-size",
+                               type=check_positive_and_not_zero_int,
+                               default=1000,
+                               help="Maximum number of pending downloads for "
+                                    "dl mode, parsing pauses while it is "
+                                    "reached")
+
+        subparser.add_argument("--priority", nargs="+", type=FBDataTypes,
+                               default=[],
+                               help="Data types to download first for dl "
+                                    "mode, in this order. PRIORITY may be "
+                                    "one or many of "
+                                    + build_fmt_str_from_enum(FBDataTypes))
+
+        subparser.add_argument("--smallest-first", action="store_true",
+                               help="Download the smallest files first for "
+                                    "dl mode (their size is requested "
+                                    "before)")
+
+        subparser.add_argument("--max-rate", type=check_positive_float,
+                               help="Global bandwidth cap for dl mode, in "
+                                    "bytes per second")
+
+        subparser.add_argument("--refresh-expired", action="store_true",
+                               help="Retry downloads whose URL has expired "
+                                    "with fresh URLs, requested only for "
+                                    "the messages containing them")
+
+        subparser.add_argument("--store", nargs="?", const=True,
+                               help="Save downloaded files once inside a "
+                                    "content-addressed STORE folder (default "
+                                    "'store' inside --output) and link them "
+                                    "inside conversation folders")
+
+        subparser.add_argument("--index", nargs="?", const=True,
+                               help="Add the messages parsed to the "
+                                    "full-text search INDEX (default "
+                                    "'search.db' inside --output), see the "
+                                    "search tool")
+
+    pipeline_parser.add_argument("--timer", type=check_positive_float,
+                                 default=1,
+                                 help="Timer in seconds between each "
+                                      "request of messages")
+
+    pipeline_parser.add_argument("--save", action="store_true",
+                                 help="Also save the JSON dump of each "
+                                      "conversation, as the dumper does")
+
+    search_parser.add_argument("query", nargs="+",
+                               help="Terms and \"quoted phrases\" which must "
+                                    "all be found inside the messages")
+
+    search_parser.add_argument("--index",
+                               help="Full-text search index built by the "
+                                    "parser --index option (default "
+                                    "'search.db' inside --output)")
+
+    search_parser.add_argument("--since", type=check_date,
+                               help="Only search messages sent from this "
+                                    "YYYY-MM-DD date")
+
+    search_parser.add_argument("--until", type=check_date,
+                               help="Only search messages sent before this "
+                                    "YYYY-MM-DD date")
+
+    search_parser.add_argument('-id', "--convers-id",
+                               help="Only search messages of this "
+                                    "conversation")
+
+    search_parser.add_argument('-l', "--limit",
+                               type=check_positive_and_not_zero_int,
+                               default=50,
+                               help="Maximum number of messages printed")
+
+    search_parser.add_argument("-v", "--verbose", action="store_true",
+                               help="Increase output verbosity")
+
+    search_parser.add_argument('-o', "--output",
+                               default=OUTPUT_DEFAULT_FOLDER,
+                               help="Output folder of the parser, where the "
+                                    "default index is")
+
     dumper_parser.set_defaults(func=dumper_tool_main)
     parser_parser.set_defaults(func=parser_tool_main)
-    for subparser in [dumper_parser, parser_parser]:
+    pipeline_parser.set_defaults(func=pipeline_tool_main)
+    search_parser.set_defaults(func=search_tool_main)
+    for subparser in [dumper_parser, parser_parser, pipeline_parser]:
         subparser.add_argument("-c", "--cookie", type=argparse.FileType("r"),
-                                     required=True,
+                                     required=subparser is not parser_parser,
                                      help="File to parse for retrieving"
                                           "headers and post data for "
                                           "intializing the scraper")
@@ -152,6 +348,22 @@ def main():
                                           "conversation ID is automatically "
                                           "created")
 
+        subparser.add_argument("--retries", type=check_positive_int,
+                               default=3,
+                               help="Number of retries of failed requests "
+                                    "and downloads")
+
+        subparser.add_argument("--backoff", type=check_positive_float,
+                               default=1,
+                               help="Base delay in seconds of the "
+                                    "exponential backoff between retries")
+
+        subparser.add_argument("--cache-ttl", type=check_positive_float,
+                               default=0,
+                               help="Use the conversations metadata cache "
+                                    "saved inside the --output folder if it "
+                                    "is younger than CACHE_TTL seconds")
+
     args = parser.parse_args()
     if hasattr(args, "func"):
         if args.verbose:
@@ -191,7 +403,13 @@ def dumper_tool_main(args):
 
     fb_dumper = FBDumper(args.convers_id, user_raw_data=user_post_data,
                          chunk_size=args.size, timer=args.timer,
-                         output=args.output)
+                         output=args.output, workers=args.workers,
+                         incremental=args.incremental, resume=args.resume,
+                         pretty=args.pretty, compression=args.compress,
+                         cache_ttl=args.cache_ttl, retries=args.retries,
+                         backoff=args.backoff,
+                         db=FBDatabase(args.db) if args.db else None,
+                         since=args.since, until=args.until)
     if args.metadata:
         print("[+] - Printing conversations metadata (total: {})"
               .format(len(fb_dumper.convers)))
@@ -212,6 +430,11 @@ def dumper_tool_main(args):
         print("[+]     - Error Occured, Facebook error summary : '{}'"
               .format(e))
 
+    if args.verbose:
+        print(fb_dumper.transport.format_stats())
+    if fb_dumper.db:
+        fb_dumper.db.close()
+
     return 0
 
 
@@ -233,10 +456,33 @@ def parser_tool_main(args):
     main : method used for parsing arguments
 
     """
-    with args.cookie as f:
-        user_raw_data = f.read()
-
-    print("[+] - Parsing JSON for {} files".format(len(args.infile)))
+    user_raw_data = None
+    if args.cookie:
+        with args.cookie as f:
+            user_raw_data = f.read()
+    elif not args.offline:
+        print("[+] - The --cookie option is required, unless --offline is "
+              "used")
+        return 1
+
+    store = args.store
+    if store is True:
+        store = os.path.join(args.output, STORE_DEFAULT_FOLDER)
+
+    index = args.index
+    if index is True:
+        index = os.path.join(args.output, SEARCH_INDEX_DEFAULT_FILENAME)
+
+    db = None
+    if args.db:
+        db = FBDatabase(args.db)
+        print("[+] - Parsing messages from the database '{}'"
+              .format(args.db))
+    elif args.infile:
+        print("[+] - Parsing JSON for {} files".format(len(args.infile)))
+    else:
+        print("[+] - The --infile or --db option is required")
+        return 1
 
     data_formatted = build_fmt_str_from_enum(args.data)
     print("[+] - Parsing JSON to retrieve {}".format(data_formatted))
@@ -244,13 +490,134 @@ def parser_tool_main(args):
     fb_parser = FBParser(user_raw_data,
                          infile_json=args.infile, mode=args.mode,
                          data=args.data, output=args.output,
-                         threads=args.threads)
+                         threads=args.threads, cache_ttl=args.cache_ttl,
+                         offline=args.offline, processes=args.processes,
+                         engine=args.engine, limit_per_host=args.per_host,
+                         store=store, queue_size=args.queue_size,
+                         priorities=args.priority,
+                         smallest_first=args.smallest_first,
+                         max_rate=args.max_rate, retries=args.retries,
+                         backoff=args.backoff,
+                         refresh_expired=args.refresh_expired, db=db,
+                         index=index, since=args.since, until=args.until)
     fb_parser.parse(to_stdout=True, verbose=args.verbose)
+    if db:
+        db.close()
+    print("[+]     - JSON parsed succesfully, saving results "
+          "inside folder '" + str(args.output) + "'")
+
+    return 0
+
+
+def pipeline_tool_main(args):
+    """Main function for the **pipeline** tool.
+
+    This method will dump Facebook conversations and parse their messages
+    while they are requested, without reading them back from JSON dumps,
+    depending on the arguments passed.
+
+    Parameters
+    ----------
+    args : Namespace (dict-like)
+        Arguments passed by the `ArgumentParser`.
+
+    See Also
+    --------
+    FBDumper: Class streaming the messages.
+    FBParser: Class parsing the messages.
+    main : method used for parsing arguments
+
+    """
+    with args.cookie as f:
+        user_raw_data = f.read()
+
+    store = args.store
+    if store is True:
+        store = os.path.join(args.output, STORE_DEFAULT_FOLDER)
+    index = args.index
+    if index is True:
+        index = os.path.join(args.output, SEARCH_INDEX_DEFAULT_FILENAME)
+
+    fb_dumper = FBDumper(args.convers_id, user_raw_data=user_raw_data,
+                         chunk_size=args.size, timer=args.timer,
+                         output=args.output, pretty=args.pretty,
+                         compression=args.compress, cache_ttl=args.cache_ttl,
+                         retries=args.retries, backoff=args.backoff,
+                         db=FBDatabase(args.db) if args.db else None,
+                         since=args.since, until=args.until)
+
+    data_formatted = build_fmt_str_from_enum(args.data)
+    print("[+] - Dumping and parsing JSON to retrieve {}"
+          .format(data_formatted))
+
+    fb_parser = FBParser(user_raw_data, dumper=fb_dumper,
+                         save_dump=args.save, mode=args.mode,
+                         data=args.data, output=args.output,
+                         threads=args.threads, engine=args.engine,
+                         limit_per_host=args.per_host, store=store,
+                         queue_size=args.queue_size,
+                         priorities=args.priority,
+                         smallest_first=args.smallest_first,
+                         max_rate=args.max_rate, retries=args.retries,
+                         backoff=args.backoff,
+                         refresh_expired=args.refresh_expired, index=index)
+    try:
+        fb_parser.parse(to_stdout=True, verbose=args.verbose)
+    except FBResponseError as e:
+        print("[+]     - Error Occured, Facebook error summary : '{}'"
+              .format(e))
+        return 1
+    finally:
+        if fb_dumper.db:
+            fb_dumper.db.close()
     print("[+]     - JSON parsed succesfully, saving results "
           "inside folder '" + str(args.output) + "'")
 
     return 0
 
 
+def search_tool_main(args):
+    """Main function for the **search** tool.
+
+    This method will search the messages matching a query inside a
+    full-text search index and print them, from the newest to the oldest.
+
+    Parameters
+    ----------
+    args : Namespace (dict-like)
+        Arguments passed by the `ArgumentParser`.
+
+    See Also
+    --------
+    FBSearchIndex: Class used for the **search** tool.
+    main : method used for parsing arguments
+
+    """
+    index_filepath = args.index or os.path.join(
+        args.output, SEARCH_INDEX_DEFAULT_FILENAME)
+    if not os.path.isfile(index_filepath):
+        print("[+] - No search index found at '{}'. Build it with the "
+              "parser --index option".format(index_filepath))
+        return 1
+
+    query = " ".join(args.query)
+    index = FBSearchIndex(index_filepath)
+    start = time.perf_counter()
+    results = index.search(query, since=args.since, until=args.until,
+                           convers_id=args.convers_id, limit=args.limit)
+    elapsed = time.perf_counter() - start
+    index.close()
+
+    print("[+] - {} messages found for '{}' in {:.1f} ms"
+          .format(len(results), query, elapsed * 1000))
+    timestamp_formatter = TimestampFormatter()
+    for result in results:
+        print("[+]     - {} - '{}' - {}: {}".format(
+            timestamp_formatter.format(result["timestamp"]),
+            result["convers_id"], result["author"], repr(result["body"])))
+
+    return 0
+
+
 if __name__ == '__main__':
     sys.exit(main())
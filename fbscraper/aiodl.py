@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""aiodl module.
+
+This module contains an asyncio download engine, an alternative to the
+threads used by the parser DL mode. Transfers are run by an event loop
+inside a background thread, so hundreds of them may be kept open without
+an OS thread for each one.
+
+It depends on the optional `aiohttp` module.
+
+Examples
+--------
+>>> from fbscraper.aiodl import FBAsyncDownloader
+>>> downloader = FBAsyncDownloader(concurrency=200, limit_per_host=16)
+>>> future = downloader.submit("https://www.facebook.com", "index.html")
+>>> future.result()
+>>> downloader.close()
+
+"""
+import asyncio
+import os
+from concurrent.futures import Future
+from itertools import count
+from queue import PriorityQueue
+from threading import Thread
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from fbscraper.lib import PART_EXTENSION, RETRY_STATUS_CODES, \
+                          CircuitBreaker, FBTransferError, get_part_size, \
+                          get_part_write_mode, get_retry_delay
+
+
+class FBAsyncDownloader(object):
+    """asyncio download engine.
+
+    Parameters
+    ----------
+    concurrency : int, optional
+        Maximum number of transfers running at once. The default is 64.
+    limit_per_host : int, optional
+        Maximum number of connections opened to the same host. The default
+        is 16.
+    buffer_size : int, optional
+        Size in bytes of the chunks read from the network and of the file
+        write buffers. The default is 1 MiB.
+    smallest_first : bool, optional
+        If True, the size of each file is probed with a HEAD request and
+        files of a same priority are downloaded from the smallest to the
+        biggest. The default is False.
+    rate_limiter : RateLimiter, optional
+        Rate limiter in bytes shared by every transfer, i.e. a global
+        bandwidth cap. The default is None (no cap).
+    retries : int, optional
+        Number of retries of a failed download. The default is 3.
+    backoff : float, optional
+        Base delay in seconds of the exponential backoff between retries
+        (see `get_retry_delay`). The default is 1.
+    circuit_breaker : CircuitBreaker, optional
+        Circuit breaker pausing every transfer when downloads keep
+        failing. It may be shared with a `FBTransport`. If None, a new one
+        is created.
+
+    Raises
+    ------
+    ImportError
+        When the `aiohttp` module is not installed.
+    ValueError
+        When `concurrency`, `limit_per_host` or `buffer_size` is inferior
+        or equal to 0.
+
+    Notes
+    -----
+    `submit` may be called from any thread and returns a
+    `concurrent.futures.Future`, like a `ThreadPoolExecutor` would.
+
+    Submitted downloads wait inside a priority queue, a transfer starts
+    with the download of lowest priority value, then the first submitted.
+
+    Failed downloads are retried like `FBTransport.call` does, interrupted
+    ones resume from their partly downloaded file. Invalid URLs are raised
+    at once.
+
+    Transfers have no total timeout, they are only aborted when connecting
+    or waiting for data takes too long.
+
+    """
+
+    _connect_timeout = 30
+    _read_timeout = 120
+
+    def __init__(self, concurrency=64, limit_per_host=16,
+                 buffer_size=1024 * 1024, smallest_first=False,
+                 rate_limiter=None, retries=3, backoff=1,
+                 circuit_breaker=None):
+        """__init__ method."""
+        if aiohttp is None:
+            raise ImportError("The asyncio download engine depends on the "
+                              "'aiohttp' module. Install it using: "
+                              "pip install aiohttp")
+        if concurrency <= 0 or limit_per_host <= 0 or buffer_size <= 0:
+            raise ValueError('Concurrency, limit_per_host and buffer_size '
+                             'must be superior to 0. Values : {}, {}, {}'
+                             .format(concurrency, limit_per_host,
+                                     buffer_size))
+        self.concurrency = concurrency
+        self.limit_per_host = limit_per_host
+        self.buffer_size = buffer_size
+        self.smallest_first = smallest_first
+        self.rate_limiter = rate_limiter
+        self.retries = retries
+        self.backoff = backoff
+        self.circuit_breaker = circuit_breaker if circuit_breaker \
+            else CircuitBreaker()
+        self.quit = False
+        self.jobs = PriorityQueue()
+        self.jobs_cnt = count()
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self._open_session(),
+                                         self.loop).result()
+
+    async def _open_session(self):
+        """Open the `aiohttp` session inside the event loop."""
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency,
+                                         limit_per_host=self.limit_per_host)
+        # No total timeout: big files on slow or rate-limited links may
+        # take longer than any fixed bound, only stalls are aborted.
+        timeout = aiohttp.ClientTimeout(total=None,
+                                        sock_connect=self._connect_timeout,
+                                        sock_read=self._read_timeout)
+        self.session = aiohttp.ClientSession(connector=connector,
+                                             timeout=timeout)
+
+    def submit(self, url, filelocation, on_complete=None, priority=0):
+        """Submit the download of a file.
+
+        Parameters
+        ----------
+        url : str
+           URL where to download the file.
+        filelocation : str
+            Path where to save file.
+        on_complete : callable, optional
+            Function called without arguments once the file is saved. It
+            is run inside the default executor of the event loop.
+        priority : int, optional
+            Priority of the download, lowest values first. The default
+            is 0.
+
+        Returns
+        -------
+        concurrent.futures.Future
+            Future of the download.
+
+        """
+        future = Future()
+        size = -1 if self.smallest_first else 0
+        self.jobs.put(((priority, size), next(self.jobs_cnt), future, url,
+                       filelocation, on_complete))
+        asyncio.run_coroutine_threadsafe(self.dl_next_file(), self.loop)
+        return future
+
+    async def dl_next_file(self):
+        """Download the file of highest priority coroutine.
+
+        One coroutine is scheduled for each submitted download. The job is
+        only taken from the queue once a transfer slot is free, so it is
+        the job of highest priority at that time.
+
+        Notes
+        -----
+        With `smallest_first`, a job whose size is unknown (-1) is probed
+        with a HEAD request and put back inside the queue.
+
+        """
+        async with self.semaphore:
+            job = self.jobs.get_nowait()
+            (priority, size), _, future, url, filelocation, on_complete = job
+            if size < 0:
+                try:
+                    async with self.session.head(
+                            url, allow_redirects=True) as r:
+                        size = r.content_length
+                except aiohttp.ClientError:
+                    size = None
+                self.jobs.put(((priority, float("inf") if size is None
+                                else size),) + job[1:])
+                asyncio.ensure_future(self.dl_next_file())
+                return
+
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                await self.dl_file_with_retries(url, filelocation,
+                                                on_complete)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(None)
+
+    async def dl_file_with_retries(self, url, filelocation, on_complete=None):
+        """Download file coroutine, retrying failed downloads.
+
+        Parameters
+        ----------
+        url : str
+           URL where to download the file.
+        filelocation : str
+            Path where to save file.
+        on_complete : callable, optional
+            Function called without arguments once the file is saved.
+
+        """
+        attempt = 0
+        while True:
+            await asyncio.sleep(self.circuit_breaker.get_wait())
+            try:
+                await self.dl_file(url, filelocation, on_complete)
+            except aiohttp.ClientResponseError as e:
+                if e.status not in RETRY_STATUS_CODES:
+                    raise e
+                self.circuit_breaker.record_failure()
+                if attempt >= self.retries:
+                    raise e
+                retry_after = e.headers.get("Retry-After") if e.headers \
+                    else None
+            except aiohttp.InvalidURL as e:
+                # A client error too, but retrying it can never succeed
+                raise e
+            except (aiohttp.ClientError, asyncio.TimeoutError,
+                    FBTransferError) as e:
+                self.circuit_breaker.record_failure()
+                if attempt >= self.retries:
+                    raise e
+                retry_after = None
+            else:
+                self.circuit_breaker.record_success()
+                return
+            await asyncio.sleep(get_retry_delay(attempt, self.backoff,
+                                                retry_after))
+            attempt += 1
+
+    async def dl_file(self, url, filelocation, on_complete=None):
+        """Download file coroutine.
+
+        Parameters
+        ----------
+        url : str
+           URL where to download the file.
+        filelocation : str
+            Path where to save file.
+        on_complete : callable, optional
+            Function called without arguments once the file is saved.
+
+        Notes
+        -----
+        Like `FBParser.dl_file`, the file is downloaded to a partly
+        downloaded file, resumed using a `Range` request, and skipped if
+        `filelocation` already exists.
+
+        Bodies are requested without `Content-Encoding`. When a server
+        encodes them anyway, they are decoded, their size is not checked
+        against the encoded `Content-Length` and they are never resumed,
+        as ranges would apply to the encoded bytes.
+
+        """
+        if not os.path.isfile(filelocation):
+            part_filelocation = filelocation + PART_EXTENSION
+            offset = get_part_size(part_filelocation)
+            headers = {"Accept-Encoding": "identity"}
+            if offset:
+                headers["Range"] = "bytes={}-".format(offset)
+
+            async with self.session.get(url, headers=headers) as r:
+                is_encoded = r.headers.get("Content-Encoding",
+                                           "identity") != "identity"
+                try:
+                    write_mode = get_part_write_mode(
+                        offset, r.status, r.headers.get("Content-Range"))
+                    if is_encoded and write_mode == 'ab':
+                        raise FBTransferError("Encoded body can not be "
+                                              "resumed")
+                except FBTransferError:
+                    if offset:
+                        os.remove(part_filelocation)
+                    raise
+                if write_mode is not None:
+                    r.raise_for_status()
+                    size = 0
+                    with open(part_filelocation, write_mode,
+                              buffering=self.buffer_size) as f:
+                        async for chunk in r.content.iter_chunked(
+                                self.buffer_size):
+                            if self.quit:
+                                return
+                            if self.rate_limiter:
+                                await asyncio.sleep(
+                                    self.rate_limiter.reserve(len(chunk)))
+                            f.write(chunk)
+                            size += len(chunk)
+                    # A connection closed early may end the body silently
+                    if not is_encoded and r.content_length is not None \
+                            and size != r.content_length:
+                        raise FBTransferError("Truncated body: {}/{} bytes "
+                                              "received".format(
+                                                  size, r.content_length))
+            os.replace(part_filelocation, filelocation)
+        if on_complete is not None:
+            await self.loop.run_in_executor(None, on_complete)
+
+    def close(self):
+        """Close the session and stop the event loop."""
+        asyncio.run_coroutine_threadsafe(self.session.close(),
+                                         self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
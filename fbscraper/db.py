@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""db module.
+
+This module contains a SQLite message store, an optional target of the
+dumper and source of the parser. Messages and attachments are saved into
+indexed tables, so questions such as "all files sent by X in 2016" are
+answered without reading whole conversations.
+
+Examples
+--------
+>>> from fbscraper.db import FBDatabase
+>>> db = FBDatabase("output/messages.db")
+>>> db.insert_messages("1234", msgs)
+>>> for msg in db.iter_messages("1234", attach_types=["file"]):
+...     print(msg["body"])
+>>> db.close()
+
+"""
+import json
+import sqlite3
+from itertools import islice
+from threading import Lock
+
+
+class FBDatabase(object):
+    """SQLite message store.
+
+    Parameters
+    ----------
+    filepath : str
+        Path of the SQLite database. It is created if it does not exist.
+    batch_size : int, optional
+        Number of messages inserted by each transaction. The default is
+        1000.
+
+    Raises
+    ------
+    ValueError
+        When the `batch_size` is inferior or equal to 0.
+
+    Notes
+    -----
+    The database uses the WAL journal mode, so it may be read while a
+    dump writes into it.
+
+    Messages are saved with their raw JSON, so `iter_messages` returns the
+    same `dict` as a JSON dump. Their author, timestamp and type are saved
+    as indexed columns, attachments inside their own indexed table.
+
+    A `FBDatabase` instance may be shared between threads.
+
+    """
+
+    _schema = """
+        CREATE TABLE IF NOT EXISTS messages (
+            message_id TEXT PRIMARY KEY,
+            convers_id TEXT NOT NULL,
+            author TEXT,
+            timestamp INTEGER NOT NULL,
+            action_type TEXT,
+            body TEXT,
+            raw TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS attachments (
+            message_id TEXT NOT NULL REFERENCES messages(message_id),
+            position INTEGER NOT NULL,
+            convers_id TEXT NOT NULL,
+            attach_type TEXT,
+            name TEXT,
+            url TEXT,
+            preview_url TEXT,
+            PRIMARY KEY (message_id, position)
+        );
+        CREATE INDEX IF NOT EXISTS messages_convers_timestamp
+            ON messages (convers_id, timestamp);
+        CREATE INDEX IF NOT EXISTS messages_author_timestamp
+            ON messages (author, timestamp);
+        CREATE INDEX IF NOT EXISTS attachments_type_convers
+            ON attachments (attach_type, convers_id);
+    """
+
+    def __init__(self, filepath, batch_size=1000):
+        """__init__ method."""
+        if batch_size <= 0:
+            raise ValueError('Batch size must be superior to 0. '
+                             'Value : {}'.format(batch_size))
+        self.filepath = filepath
+        self.batch_size = batch_size
+        self.lock = Lock()
+        self.connection = sqlite3.connect(filepath, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(self._schema)
+
+    def insert_messages(self, convers_id, msgs):
+        """Insert messages of a conversation, with their attachments.
+
+        Messages already saved (same `message_id`) are replaced.
+
+        Parameters
+        ----------
+        convers_id : str
+            Conversation ID of the messages.
+        msgs : iterable
+            JSON formatted Facebook messages.
+
+        Returns
+        -------
+        int
+            Return the number of messages inserted.
+
+        """
+        msgs = iter(msgs)
+        cnt = 0
+        while True:
+            batch = list(islice(msgs, self.batch_size))
+            if not batch:
+                return cnt
+            msg_rows = []
+            attachment_rows = []
+            for msg in batch:
+                msg_rows.append((msg["message_id"], convers_id,
+                                 msg.get("author"), msg["timestamp"],
+                                 msg.get("action_type"), msg.get("body"),
+                                 json.dumps(msg)))
+                for position, attachment in enumerate(
+                        msg.get("attachments") or []):
+                    attachment_rows.append((
+                        msg["message_id"], position, convers_id,
+                        attachment.get("attach_type"),
+                        attachment.get("name"), attachment.get("url"),
+                        attachment.get("preview_url")))
+            with self.lock, self.connection:
+                self.connection.executemany(
+                    "DELETE FROM attachments WHERE message_id = ?",
+                    ((row[0],) for row in msg_rows))
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO messages VALUES "
+                    "(?, ?, ?, ?, ?, ?, ?)", msg_rows)
+                self.connection.executemany(
+                    "INSERT INTO attachments VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    attachment_rows)
+            cnt += len(batch)
+
+    def get_convers_ids(self):
+        """Get the IDs of the conversations saved.
+
+        Returns
+        -------
+        list
+            Return the conversation IDs.
+
+        """
+        with self.lock:
+            return [row[0] for row in self.connection.execute(
+                "SELECT DISTINCT convers_id FROM messages")]
+
+    def iter_messages(self, convers_id, attach_types=None, since=None,
+                      until=None):
+        """Iterate over the messages of a conversation.
+
+        Parameters
+        ----------
+        convers_id : str
+            Conversation ID.
+        attach_types : list of str, optional
+            If provided, only the messages with at least one attachment of
+            these `attach_type` are returned.
+        since : int, optional
+            Only the messages sent from this timestamp (in ms) are
+            returned.
+        until : int, optional
+            Only the messages sent before this timestamp (in ms) are
+            returned.
+
+        Yields
+        ------
+        dict
+            JSON formatted Facebook messages, from the oldest to the
+            newest.
+
+        """
+        query = "SELECT raw FROM messages WHERE convers_id = ?"
+        params = [convers_id]
+        if since is not None:
+            query += " AND timestamp >= ?"
+            params.append(since)
+        if until is not None:
+            query += " AND timestamp < ?"
+            params.append(until)
+        if attach_types is not None:
+            query += (" AND message_id IN (SELECT message_id FROM "
+                      "attachments WHERE convers_id = ? AND attach_type IN "
+                      "(" + ", ".join("?" * len(attach_types)) + "))")
+            params += [convers_id] + list(attach_types)
+        query += " ORDER BY timestamp, rowid"
+
+        with self.lock:
+            cursor = self.connection.execute(query, params)
+            rows = cursor.fetchmany(self.batch_size)
+        while rows:
+            for row in rows:
+                yield json.loads(row[0])
+            with self.lock:
+                rows = cursor.fetchmany(self.batch_size)
+
+    def close(self):
+        """Close the connection to the database."""
+        with self.lock:
+            self.connection.close()
@@ -15,13 +15,22 @@ import copy
 import json
 import os
 import re
-import time
+import shutil
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
 
-import requests
 from unidecode import unidecode
 
-from fbscraper.lib import FBConversType, FBResponseError, FBUnknownConvers, \
-                           OUTPUT_DEFAULT_FOLDER
+from fbscraper.lib import FBCompression, FBConversType, FBResponseError, \
+                          FBUnknownConvers, OUTPUT_DEFAULT_FOLDER, \
+                          METADATA_CACHE_FILENAME, DUMP_INDEX_BUCKET_SIZE, \
+                          RateLimiter, build_dump_filepath, \
+                          build_dump_index_filepath, find_dump_filepath, \
+                          iter_dump, open_dump, read_dump_index, \
+                          read_metadata_cache, write_dump_index, \
+                          write_metadata_cache
+from fbscraper.transport import FBTransport
 
 
 class FBDumper(object):
@@ -33,6 +42,7 @@ class FBDumper(object):
     _url_convers_list = "https://www.facebook.com/ajax/mercury/" \
                         "threadlist_info.php"
     _end_flag = "end_of_history"
+    _chunks_folder = "chunks"
     _basic_headers = {
         "origin": "https://www.facebook.com",
         "accept-encoding": "gzip,deflate",
@@ -50,7 +60,10 @@ class FBDumper(object):
 
     def __init__(self, convers_ids=None, user_raw_data=None,
                  infile_user_raw_data=None, chunk_size=2000,
-                 timer=1, output=OUTPUT_DEFAULT_FOLDER):
+                 timer=1, output=OUTPUT_DEFAULT_FOLDER, transport=None,
+                 workers=1, incremental=False, resume=False, pretty=False,
+                 compression=FBCompression.NONE, cache_ttl=0, retries=3,
+                 backoff=1, db=None, since=None, until=None):
         """__init__ method.
 
         Parameters
@@ -67,9 +80,54 @@ class FBDumper(object):
            The default is 2000.
         timer : int, optional
            Timer between each request made by the dumper. The default is 1.
+           When several `workers` are used, it is the timer between each
+           request made by all workers together.
         output : str, optional
             Folder output where to save data. May be common between
             conversation dumped or parsed.
+        transport : FBTransport, optional
+            Transport used for making requests. It may be shared with a
+            `FBParser`. If None, a new one is created.
+        workers : int, optional
+            Number of conversations dumped concurrently. The default is 1.
+        incremental : bool, optional
+            If True, conversations already dumped inside `output` are only
+            updated with their new messages. Conversations without new
+            messages are skipped. The default is False.
+        resume : bool, optional
+            If True, conversations are dumped from their last checkpoint
+            left by an interrupted dump. The default is False.
+        pretty : bool, optional
+            If True, a 'pretty' JSON dump is also saved for each
+            conversation. The default is False.
+        compression : FBCompression, optional
+            Compression used for JSON dumps. The default is
+            `FBCompression.NONE`.
+        cache_ttl : float, optional
+            Conversations metadata are always saved to a cache file inside
+            `output`. If the cache is younger than `cache_ttl` seconds, it
+            is used instead of requesting metadata from Facebook. It is not
+            used with `incremental` or `since`, which skip conversations
+            from their last message timestamp, stale in the cache. The
+            default is 0 (the cache is never used).
+        retries : int, optional
+            Number of retries of a failed request. Only used when no
+            `transport` is provided. The default is 3.
+        backoff : float, optional
+            Base delay in seconds of the exponential backoff between
+            retries. Only used when no `transport` is provided. The default
+            is 1.
+        db : FBDatabase, optional
+            SQLite message store where to also save the messages dumped.
+            The default is None.
+        since : int, optional
+            Only the messages sent from this timestamp (in ms) are dumped.
+            Older pages are not requested. With `incremental`, messages
+            already dumped are kept whatever their timestamp. The default
+            is None.
+        until : int, optional
+            Only the messages sent before this timestamp (in ms) are
+            dumped. Newer pages are not requested. The default is None.
 
         Raises
         ------
@@ -81,6 +139,12 @@ class FBDumper(object):
 
             When the number of the `timer` is inferior to 0.
 
+            When the number of `workers` is inferior or equal to 0.
+
+            When the `cache_ttl` is inferior to 0.
+
+            When `since` is superior or equal to `until`.
+
         """
         self.convers_ids = convers_ids
 
@@ -103,12 +167,50 @@ class FBDumper(object):
             raise ValueError('You should provide a postive or 0 integer value'
                              'the timer. Value : {}'.format(timer))
         self.timer = timer
+        self.rate_limiter = RateLimiter(1 / timer) if timer > 0 else None
+
+        if workers <= 0:
+            raise ValueError('You should provide a postive integer value for '
+                             'the workers. Value : {}'.format(workers))
+        self.workers = workers
+        self.incremental = incremental
+        self.resume = resume
+        self.pretty = pretty
+        self.compression = compression
+        self.db = db
+        if since is not None and until is not None and since >= until:
+            raise ValueError('You should provide a since timestamp inferior '
+                             'to the until one. Values : {}, {}'
+                             .format(since, until))
+        self.since = since
+        self.until = until
+        self.quit = False
 
         self.output = os.path.join(output, '')
         os.makedirs(self.output, exist_ok=True)
 
+        self.transport = transport if transport \
+            else FBTransport(pool_size=workers, retries=retries,
+                             backoff=backoff)
+
         self.headers, self.post_data = self.get_post_data()
-        self.convers, self.participants = self.get_all_convers_metadata()
+
+        if cache_ttl < 0:
+            raise ValueError('You should provide a postive or 0 value for '
+                             'the cache_ttl. Value : {}'.format(cache_ttl))
+        self.metadata_cache = self.output + METADATA_CACHE_FILENAME
+        use_cache = (cache_ttl > 0 and not self.incremental
+                     and self.since is None)
+        cached_metadata = read_metadata_cache(self.metadata_cache,
+                                              cache_ttl) \
+            if use_cache else None
+        if cached_metadata:
+            self.convers, self.participants = cached_metadata
+        else:
+            self.convers, self.participants = \
+                self.get_all_convers_metadata()
+            write_metadata_cache(self.metadata_cache, self.convers,
+                                 self.participants)
 
     def get_post_data(self):
         """Method for getting headers and POST data.
@@ -165,11 +267,15 @@ class FBDumper(object):
             When Facebook responds with an errort report. Usually it means
             that your POST data and headers are expired.
 
+        Notes
+        -----
+        Failed requests and responses which are not valid JSON are retried
+        by `self.transport` (see `FBTransport.request`).
+
         """
-        r = requests.post(url, headers=self.headers,
-                          data=data)
-        raw_response = r.text[9:]
-        json_data = json.loads(raw_response)
+        json_data = self.transport.request(
+            "POST", url, parse=lambda r: json.loads(r.text[9:]),
+            headers=self.headers, data=data)
 
         if "error" in json_data:
             raise FBResponseError(json_data["errorSummary"])
@@ -217,6 +323,31 @@ class FBDumper(object):
         data_for_msgs.update(self.post_data)
         return data_for_msgs
 
+    def get_messages_before(self, convers_id, timestamp):
+        """Get the page of messages of a conversation before a timestamp.
+
+        Parameters
+        ----------
+        convers_id : str
+            Conversation ID.
+        timestamp : int
+            Only messages sent before this timestamp (in ms) are returned.
+
+        Returns
+        -------
+        list
+            Return the last `self.chunk_size` messages sent before
+            `timestamp`, from the oldest to the newest.
+
+        """
+        data_for_msgs = self.build_data(convers_id,
+                                        self.convers[convers_id]["type"],
+                                        0, str(timestamp))
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+        json_data = self.make_request(self._url_convers, data_for_msgs)
+        return json_data["payload"].get("actions", [])
+
     def get_all_convers_metadata(self):
         """Method for getting all conversations metadata (inbox & archived)."""
         convers = {}
@@ -287,11 +418,61 @@ class FBDumper(object):
         verbose: bool
             Print additionnal traces to stdout.
 
+        Raises
+        ------
+        FBUnknownConvers
+            When a conversation ID does not match any conversation.
+
         Notes
         -----
         If `self.convers_ids` is None every conversations
         will be dumped.
 
+        Each page of messages is saved as a checkpoint inside the
+        `chunks` folder of the conversation, until the final JSON dump is
+        assembled from them. An interrupted dump may be continued using
+        `self.resume`.
+
+        When `self.workers` is superior to 1, conversations are dumped
+        concurrently. Requests made by all workers share the same
+        `self.rate_limiter`.
+
+        """
+        convers_ids = self.get_convers_ids()
+
+        self.quit = False
+        if self.workers == 1:
+            for c in convers_ids:
+                self.dump_convers(c, to_stdout, verbose)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            dump_futures = [executor.submit(self.dump_convers, c, to_stdout,
+                                            verbose)
+                            for c in convers_ids]
+            try:
+                for future in futures.as_completed(dump_futures):
+                    future.result()
+            except BaseException:
+                self.quit = True
+                for future in dump_futures:
+                    future.cancel()
+                raise
+
+    def get_convers_ids(self):
+        """Get the IDs of the conversations to dump.
+
+        Returns
+        -------
+        list
+            Return `self.convers_ids`, or every conversation ID if it is
+            None.
+
+        Raises
+        ------
+        FBUnknownConvers
+            When a conversation ID does not match any conversation.
+
         """
         if self.convers_ids:
             convers_ids = self.convers_ids
@@ -301,52 +482,386 @@ class FBDumper(object):
                 convers_ids.append(c)
 
         for c in convers_ids:
-
             if c not in self.convers:
                 raise FBUnknownConvers("Conversation ID '{}' does not match "
                                        "any conversation from the user."
                                        .format(c))
+        return convers_ids
+
+    def build_convers_location(self, convers_id):
+        """Build the folder where the JSON dump of a conversation is saved.
+
+        Parameters
+        ----------
+        convers_id : str
+            Conversation ID.
+
+        Returns
+        -------
+        str
+            Return the folder path, ending with a separator.
+
+        """
+        return self.output + convers_id + " - " \
+            + unidecode(self.convers[convers_id]["name"]) + os.sep
+
+    def iter_pages(self, convers_id, offset=0, cursor=None,
+                   stop_timestamp=None, to_stdout=False):
+        """Request the pages of messages of a conversation, one at a time.
+
+        Parameters
+        ----------
+        convers_id : str
+            Conversation ID.
+        offset : int, optional
+            Offset of the first request. The default is 0.
+        cursor : int, optional
+            Timestamp of the first request, as returned with the previous
+            page. If None, pages are requested from `self.until`, or from
+            the newest message.
+        stop_timestamp : int, optional
+            Pages are not requested anymore once the timestamp cursor is
+            inferior or equal to it. If None, they are requested until the
+            end of the history.
+        to_sdout : bool
+           Print traces to stdout when it is True. The default is False.
+
+        Yields
+        ------
+        dict
+            Pages from the newest to the oldest, as saved by
+            `write_checkpoint`: their messages ("actions") in chronological
+            order, the "offset" and "timestamp" of the next request and an
+            "end_of_history" flag.
+
+        """
+        c = convers_id
+        if cursor is not None:
+            timestamp = cursor
+        else:
+            timestamp = str(self.until) if self.until is not None else "0"
+
+        while not (stop_timestamp is not None and cursor is not None
+                   and cursor <= stop_timestamp):
+            if self.quit:
+                return
+
+            data_for_msgs = self.build_data(c, self.convers[c]["type"],
+                                            offset, timestamp)
 
             if to_stdout:
-                print("[+] - Dumping JSON from conversation with ID: '{}' "
-                      "and name: '{}'".format(c, unidecode(self.convers[c]
-                                                           ["name"])))
+                print("[+]     - Retrieving messages " + str(offset)
+                      + "-" + str(self.chunk_size + offset)
+                      + (" from '" + c + "'" if self.workers > 1 else ""))
 
-            messages = []
-            current_convers = self.convers[c]
-            offset = 0
-            timestamp = "0"
-            json_data = {"payload": {}}
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            json_data = self.make_request(self._url_convers,
+                                          data_for_msgs, True)
 
-            while self._end_flag not in json_data["payload"]:
+            actions = json_data['payload'].get('actions')
+            if not actions:
+                return
+            timestamp = cursor = actions[0]['timestamp']
+            offset = offset + self.chunk_size
+            is_dumped = self._end_flag in json_data["payload"]
 
-                data_for_msgs = self.build_data(c,
-                                                current_convers["type"],
-                                                offset, timestamp)
+            yield {"actions": actions, "offset": offset,
+                   "timestamp": timestamp, "end_of_history": is_dumped}
+            if is_dumped:
+                return
 
-                if to_stdout:
-                    print("[+]     - Retrieving messages " + str(offset)
-                          + "-" + str(self.chunk_size + offset))
+    def iter_convers(self, convers_id, to_stdout=False, save=False):
+        """Iterate over the messages of a conversation while requesting them.
 
-                json_data = self.make_request(self._url_convers,
-                                              data_for_msgs, True)
+        Messages are returned as soon as their page is received, so they
+        may be processed while next pages are requested.
 
-                messages = json_data['payload']['actions'] + messages
-                timestamp = json_data['payload']['actions'][0]['timestamp']
+        Parameters
+        ----------
+        convers_id : str
+            Conversation ID.
+        to_sdout : bool
+           Print traces to stdout when it is True. The default is False.
+        save : bool, optional
+            If True, the JSON dump of the conversation is also written,
+            like `dump_convers` does, once every message is returned. The
+            default is False.
 
-                offset = offset + self.chunk_size
-                time.sleep(self.timer)
-            filelocation = self.output + c + " - " \
-                + unidecode(self.convers[c]["name"]) + os.sep
+        Yields
+        ------
+        dict
+            JSON Formatted Facebook messages between `self.since` and
+            `self.until`, page by page from the newest page to the oldest
+            one, and in chronological order inside each page.
+
+        Notes
+        -----
+        Checkpoints, `self.resume` and `self.incremental` are not used.
+        Messages are also saved inside `self.db` page by page.
+
+        """
+        c = convers_id
+        if to_stdout:
+            print("[+] - Streaming JSON from conversation with ID: '{}' "
+                  "and name: '{}'".format(c, unidecode(self.convers[c]
+                                                       ["name"])))
+        if (self.since is not None
+                and self.convers[c]["last_message_timestamp"] < self.since):
+            return
+
+        stop_timestamp = self.since - 1 if self.since is not None else None
+        pages = []
+        for page in self.iter_pages(c, stop_timestamp=stop_timestamp,
+                                    to_stdout=to_stdout):
+            msgs = [m for m in page["actions"] if self.is_in_range(m)]
+            if self.db:
+                self.db.insert_messages(c, msgs)
+            if save:
+                pages.append(msgs)
+            for msg in msgs:
+                yield msg
+
+        if save and any(pages) and not self.quit:
+            filelocation = self.build_convers_location(c)
             os.makedirs(filelocation, exist_ok=True)
-            self.write_dump_to_file(messages, filelocation, 2)
+            self.write_dump_to_file(chain.from_iterable(reversed(pages)),
+                                    filelocation, 2 if self.pretty else 0,
+                                    compression=self.compression)
+
+    def dump_convers(self, convers_id, to_stdout=False, verbose=False):
+        """Method for dumping a single Facebook JSON conversation.
+
+        Parameters
+        ----------
+        convers_id : str
+            Conversation ID to dump.
+        to_sdout : bool
+           Print traces to stdout when it is True. The default is False.
+        verbose: bool
+            Print additionnal traces to stdout.
+
+        """
+        c = convers_id
+        if to_stdout:
+            print("[+] - Dumping JSON from conversation with ID: '{}' "
+                  "and name: '{}'".format(c, unidecode(self.convers[c]
+                                                       ["name"])))
+
+        filelocation = self.build_convers_location(c)
+
+        if (self.since is not None
+                and self.convers[c]["last_message_timestamp"] < self.since):
+            if to_stdout:
+                print("[+]     - No message since the time range start, "
+                      "skipping it")
+            return
+
+        known_filepath = None
+        known_timestamp = None
+        if self.incremental:
+            known_filepath = find_dump_filepath(filelocation, 'complete')
+            if known_filepath:
+                known_timestamp = self.read_last_timestamp(known_filepath)
+            if known_timestamp is None:
+                known_filepath = None
+            elif (self.convers[c]["last_message_timestamp"]
+                    <= known_timestamp):
+                if to_stdout:
+                    print("[+]     - Conversation is up to date, "
+                          "skipping it")
+                return
+
+        # Pagination stops once the timestamp cursor reaches known
+        # messages or leaves the time range.
+        stop_timestamp = known_timestamp
+        if self.since is not None:
+            stop_timestamp = max(self.since - 1, known_timestamp or 0)
+
+        offset = 0
+        cursor = None
+        is_dumped = False
+
+        chunks_location = filelocation + self._chunks_folder + os.sep
+        checkpoints = self.read_checkpoints(chunks_location) \
+            if self.resume else []
+        if checkpoints:
+            last_checkpoint = checkpoints[-1]
+            offset = last_checkpoint["offset"]
+            cursor = last_checkpoint["timestamp"]
+            is_dumped = last_checkpoint["end_of_history"]
+            if to_stdout:
+                print("[+]     - Resuming from checkpoint {} ({} chunks)"
+                      .format(offset, len(checkpoints)))
+        else:
+            shutil.rmtree(chunks_location, ignore_errors=True)
+        os.makedirs(chunks_location, exist_ok=True)
+        nb_checkpoints = len(checkpoints)
+
+        if not is_dumped:
+            for page in self.iter_pages(c, offset, cursor, stop_timestamp,
+                                        to_stdout):
+                self.write_checkpoint(chunks_location, nb_checkpoints,
+                                      **page)
+                nb_checkpoints += 1
+            if self.quit:
+                return
+
+        pages = [checkpoint["actions"] for checkpoint
+                 in self.read_checkpoints(chunks_location)]
+        if self.since is not None or self.until is not None:
+            # Only fetched pages are filtered, messages already dumped are
+            # all kept by an incremental dump.
+            pages = [[m for m in page if self.is_in_range(m)]
+                     for page in pages]
+            if not known_filepath and not any(pages):
+                if to_stdout:
+                    print("[+]     - No message inside the time range")
+                shutil.rmtree(chunks_location, ignore_errors=True)
+                return
+        messages = chain.from_iterable(reversed(pages))
+
+        if known_filepath:
+            # Known messages are streamed from the previous dump, only the
+            # ones overlapping the fetched pages are read for deduplication.
+            new_msgs = list(messages)
+            known_ids = set()
+            if new_msgs:
+                since = min(m["timestamp"] for m in new_msgs)
+                known_ids = set(m["message_id"] for m
+                                in iter_dump(known_filepath, since=since))
+            new_msgs = [m for m in new_msgs
+                        if m["message_id"] not in known_ids]
+            if to_stdout:
+                print("[+]     - Merging {} new messages".format(
+                    len(new_msgs)))
+            messages = chain(iter_dump(known_filepath), new_msgs)
+
+        os.makedirs(filelocation, exist_ok=True)
+        self.write_dump_to_file(messages, filelocation,
+                                2 if self.pretty else 0,
+                                compression=self.compression)
+        if self.db:
+            # Messages already known were saved by a previous dump
+            self.db.insert_messages(c, chain.from_iterable(reversed(pages)))
+        shutil.rmtree(chunks_location, ignore_errors=True)
+
+    def is_in_range(self, msg):
+        """Check if msg was sent between `self.since` and `self.until`.
+
+        Parameters
+        ----------
+        msg : dict
+            JSON Formatted Facebook message.
+
+        Returns
+        -------
+        bool
+            True if the message is inside the time range, False otherwise.
+
+        """
+        return ((self.since is None or msg["timestamp"] >= self.since)
+                and (self.until is None or msg["timestamp"] < self.until))
+
+    def write_checkpoint(self, chunks_location, index, actions, offset,
+                         timestamp, end_of_history):
+        """Write a page of messages to disk as a checkpoint.
+
+        Parameters
+        ----------
+        chunks_location : str
+            Folder where to save checkpoints.
+        index : int
+            Index of the page, starting from 0 for the newest messages.
+        actions : list
+            Messages of the page.
+        offset : int
+            Offset of the request following this page.
+        timestamp : str
+            Timestamp of the request following this page.
+        end_of_history : bool
+            True if the page is the last one of the conversation.
+
+        Notes
+        -----
+        The checkpoint is written to a temporary file first and then
+        renamed, so a crash never leaves a truncated checkpoint.
+
+        """
+        filepath = chunks_location + "{:06d}.json".format(index)
+        with open(filepath + ".tmp", 'w') as f:
+            json.dump({"offset": offset, "timestamp": timestamp,
+                       "end_of_history": end_of_history,
+                       "actions": actions}, f)
+        os.replace(filepath + ".tmp", filepath)
+
+    def read_checkpoints(self, chunks_location):
+        """Read every checkpoint written by `write_checkpoint`.
+
+        Parameters
+        ----------
+        chunks_location : str
+            Folder where checkpoints are saved.
+
+        Returns
+        -------
+        list
+            Checkpoints `dict` ordered from the newest page to the oldest
+            one. Empty if no checkpoint exists.
+
+        """
+        if not os.path.isdir(chunks_location):
+            return []
+        checkpoints = []
+        for filename in sorted(os.listdir(chunks_location)):
+            if filename.endswith(".json"):
+                with open(chunks_location + filename, 'r') as f:
+                    checkpoints.append(json.load(f))
+        return checkpoints
+
+    def read_last_timestamp(self, filepath):
+        """Read the timestamp of the newest message of a JSON dump.
+
+        Parameters
+        ----------
+        filepath : str
+            Filepath of a JSON dump written by `write_dump_to_file`.
+
+        Returns
+        -------
+        int
+            Timestamp of the newest message. None if the dump is empty.
+
+        Notes
+        -----
+        Messages are streamed (see `iter_dump`). When the dump has an
+        offset index, only the messages of its last bucket are decoded.
+
+        """
+        since = None
+        buckets = read_dump_index(filepath)
+        if buckets:
+            since = buckets[-1][0] * DUMP_INDEX_BUCKET_SIZE
+        last_timestamp = None
+        for msg in iter_dump(filepath, since=since):
+            if last_timestamp is None or msg["timestamp"] > last_timestamp:
+                last_timestamp = msg["timestamp"]
+        return last_timestamp
 
     def write_dump_to_file(self, dump, filelocation, mode=0,
-                           base_filename='complete'):
+                           base_filename='complete',
+                           compression=FBCompression.NONE):
         """Write JSON dump to files.
 
+        Messages are serialized one at a time while iterating over `dump`,
+        so the whole JSON string is never built in memory.
+
         Parameters
         ----------
+        dump : iterable
+            Messages to write, in chronological order.
+        filelocation : str
+            Folder where to save the JSON dump(s).
         mode : int, optional
             Integer to know if you want to save raw JSON (`mode` == 0),
             'pretty' JSON (`mode` == 1) or both (`mode` == 2).
@@ -354,6 +869,9 @@ class FBDumper(object):
         base_filename : str, optional
             base_filename to construct the final filename where to save
             JSON dump(s).
+        compression : FBCompression, optional
+            Compression used for the JSON dump(s). The default is
+            `FBCompression.NONE`.
 
         Notes
         -----
@@ -361,14 +879,79 @@ class FBDumper(object):
 
         Pretty JSON filename is : `base_filename` + 'pretty.json'
 
+        The compression extension (e.g. '.gz') is appended to filenames.
+        Dumps previously written with another compression are removed.
+
+        Dumps are written to hidden temporary files (e.g. '.complete.json')
+        first and then renamed, so an interrupted write never replaces a
+        previous dump, nor leaves a file matched by 'complete.json*'.
+        Temporary files are removed when writing fails.
+
+        An uncompressed raw JSON dump gets an offset index, saved as
+        `base_filename` + '.idx.json' (see `write_dump_index`), letting
+        the parser only decode the messages of a time range.
+
         """
         if mode < 0 or mode > 2:
             raise ValueError("Mode parameter must be 0, 1 or 2. Mode : {}"
                              .format(mode))
+        base_filenames = []
         if mode == 0 or mode == 2:
-            with open(filelocation + base_filename + ".json", 'w') as f:
-                json.dump(dump, f)
-
+            base_filenames.append(base_filename)
         if mode == 1 or mode == 2:
-            with open(filelocation + base_filename + ".pretty.json", 'w') as f:
-                json.dump(dump, f, indent=4)
+            base_filenames.append(base_filename + ".pretty")
+
+        filepaths = [build_dump_filepath(filelocation, b, compression)
+                     for b in base_filenames]
+        tmp_filepaths = [os.path.join(os.path.dirname(filepath),
+                                      "." + os.path.basename(filepath))
+                         for filepath in filepaths]
+        files = [open_dump(tmp_filepath, 'w')
+                 for tmp_filepath in tmp_filepaths]
+        # JSON is written as ASCII, so characters are counted as bytes
+        is_indexed = compression == FBCompression.NONE and mode != 1
+        buckets = []
+        offset = 0
+        try:
+            is_first = True
+            for msg in dump:
+                if mode == 0 or mode == 2:
+                    separator = "[" if is_first else ", "
+                    msg_json = json.dumps(msg)
+                    files[0].write(separator + msg_json)
+                    offset += len(separator)
+                    bucket = msg["timestamp"] // DUMP_INDEX_BUCKET_SIZE
+                    if not buckets or bucket > buckets[-1][0]:
+                        buckets.append([bucket, offset])
+                    offset += len(msg_json)
+                if mode == 1 or mode == 2:
+                    files[-1].write(("[\n    " if is_first else ",\n    ")
+                                    + json.dumps(msg, indent=4)
+                                    .replace("\n", "\n    "))
+                is_first = False
+            if mode == 0 or mode == 2:
+                files[0].write("[]" if is_first else "]")
+            if mode == 1 or mode == 2:
+                files[-1].write("[]" if is_first else "\n]")
+        except BaseException:
+            for f, tmp_filepath in zip(files, tmp_filepaths):
+                f.close()
+                os.remove(tmp_filepath)
+            raise
+        finally:
+            for f in files:
+                f.close()
+
+        for tmp_filepath, filepath in zip(tmp_filepaths, filepaths):
+            os.replace(tmp_filepath, filepath)
+        index_filepath = build_dump_index_filepath(
+            build_dump_filepath(filelocation, base_filename))
+        if is_indexed:
+            write_dump_index(filepaths[0], buckets)
+        elif mode != 1 and os.path.isfile(index_filepath):
+            os.remove(index_filepath)
+        for b in base_filenames:
+            for c in FBCompression:
+                stale_filepath = build_dump_filepath(filelocation, b, c)
+                if c != compression and os.path.isfile(stale_filepath):
+                    os.remove(stale_filepath)
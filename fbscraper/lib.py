@@ -5,15 +5,33 @@
 This module contains general functions (some sort of a library).
 
 """
+import codecs
+import gzip
+import json
+import lzma
+import mmap
+import os
+import random
+import re
 import sys
 import time
-from datetime import datetime
+from bisect import bisect_left
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from itertools import cycle
-from threading import Thread
+from threading import Lock, Thread
 
 from enum import Enum
 
 OUTPUT_DEFAULT_FOLDER = "output"
+STORE_DEFAULT_FOLDER = "store"
+SEARCH_INDEX_DEFAULT_FILENAME = "search.db"
+JSON_READ_CHUNK_SIZE = 64 * 1024
+PART_EXTENSION = ".part"
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+EXPIRED_STATUS_CODES = (403, 410)
+METADATA_CACHE_FILENAME = "convers_metadata.json"
+DUMP_INDEX_BUCKET_SIZE = 24 * 3600 * 1000
 
 
 class FBDataTypes(Enum):
@@ -51,6 +69,36 @@ class FBParserMode(Enum):
     DL = "dl"
 
 
+class FBDownloadEngine(Enum):
+    """Enumeration containing download engines for the FBParser DL mode.
+
+    Attributes
+    ----------
+    THREADS : FBDownloadEngine
+        Each download runs inside a thread of a pool.
+    ASYNC : FBDownloadEngine
+        Downloads run inside an asyncio event loop (see `FBAsyncDownloader`).
+
+    """
+
+    THREADS = "threads"
+    ASYNC = "async"
+
+
+class FBCompression(Enum):
+    """Enumeration containing compressions available for JSON dumps.
+
+    Notes
+    -----
+    These `Enum` values are also used as JSON dumps file extensions.
+
+    """
+
+    NONE = "none"
+    GZIP = "gz"
+    XZ = "xz"
+
+
 class FBConversType(Enum):
     """Enumeration for type conversation (group conversation)."""
 
@@ -64,6 +112,17 @@ class FBResponseError(Exception):
     pass
 
 
+class FBTransferError(ValueError):
+    """Exception when a response does not match the file being downloaded.
+
+    The body may be truncated, or may not continue the partly downloaded
+    file. Unlike other `ValueError`, the download may be retried.
+
+    """
+
+    pass
+
+
 class FBUnknownConvers(Exception):
     """Exception when conversation ID does not match any conversation.
 
@@ -113,6 +172,646 @@ class PrintLoading(Thread):
         sys.stdout.flush()
 
 
+class RateLimiter(object):
+    """Token bucket rate limiter which may be shared between threads.
+
+    Parameters
+    ----------
+    rate : float
+        Number of tokens added to the bucket each second.
+    capacity : float, optional
+        Maximum number of tokens the bucket may hold, i.e. the size of the
+        allowed burst. The default is 1.
+
+    Raises
+    ------
+    ValueError
+        When the `rate` or the `capacity` is inferior or equal to 0.
+
+    Notes
+    -----
+    A caller asking for more tokens than available takes them in advance
+    and sleeps until the debt is paid back, therefore callers are served in
+    the order they call `acquire`.
+
+    """
+
+    def __init__(self, rate, capacity=1):
+        """__init__ method."""
+        if rate <= 0 or capacity <= 0:
+            raise ValueError('Rate and capacity must be superior to 0. '
+                             'Rate : {} - Capacity : {}'
+                             .format(rate, capacity))
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+        self.lock = Lock()
+
+    def acquire(self, tokens=1):
+        """Take `tokens` from the bucket, sleeping if it is empty.
+
+        Parameters
+        ----------
+        tokens : float, optional
+            Number of tokens to take. The default is 1.
+
+        """
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    def reserve(self, tokens=1):
+        """Take `tokens` from the bucket without sleeping.
+
+        Parameters
+        ----------
+        tokens : float, optional
+            Number of tokens to take. The default is 1.
+
+        Returns
+        -------
+        float
+            Return the number of seconds the caller must wait before using
+            the tokens, e.g. with `asyncio.sleep` inside an event loop.
+
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens
+                              + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            self.tokens -= tokens
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+
+class CircuitBreaker(object):
+    """Circuit breaker which may be shared between threads.
+
+    After `threshold` consecutive failures, the circuit opens: every caller
+    of `wait` is paused for `cooldown` seconds. Then one more failure opens
+    it again, while a success closes it.
+
+    Parameters
+    ----------
+    threshold : int, optional
+        Number of consecutive failures opening the circuit. The default
+        is 5.
+    cooldown : float, optional
+        Number of seconds the circuit stays open. The default is 60.
+
+    Raises
+    ------
+    ValueError
+        When the `threshold` or the `cooldown` is inferior or equal to 0.
+
+    """
+
+    def __init__(self, threshold=5, cooldown=60):
+        """__init__ method."""
+        if threshold <= 0 or cooldown <= 0:
+            raise ValueError('Threshold and cooldown must be superior to 0. '
+                             'Threshold : {} - Cooldown : {}'
+                             .format(threshold, cooldown))
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0
+        self.lock = Lock()
+
+    def get_wait(self):
+        """Get the number of seconds to wait before making a request."""
+        with self.lock:
+            return max(0, self.open_until - time.monotonic())
+
+    def wait(self):
+        """Sleep while the circuit is open."""
+        wait = self.get_wait()
+        if wait > 0:
+            time.sleep(wait)
+
+    def record_success(self):
+        """Record a successful request, closing the circuit."""
+        with self.lock:
+            self.failures = 0
+
+    def record_failure(self):
+        """Record a failed request, opening the circuit if needed."""
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.open_until = time.monotonic() + self.cooldown
+
+
+def get_retry_delay(attempt, backoff, retry_after=None, max_delay=300):
+    """Get the delay before retrying a failed request.
+
+    Parameters
+    ----------
+    attempt : int
+        Number of the failed attempt, starting from 0.
+    backoff : float
+        Base delay in seconds of the exponential backoff.
+    retry_after : str, optional
+        'Retry-After' header of the response, in seconds or as an HTTP
+        date. It is used instead of the backoff when provided.
+    max_delay : float, optional
+        Maximum delay in seconds of the exponential backoff. The default
+        is 300.
+
+    Returns
+    -------
+    float
+        Return the delay in seconds. Without `retry_after`, it is drawn
+        uniformly between 0 and `backoff` * 2 ** `attempt` (full jitter),
+        so that concurrent callers do not retry all at once.
+
+    """
+    if retry_after:
+        try:
+            return max(0, float(retry_after))
+        except ValueError:
+            pass
+        try:
+            retry_date = parsedate_to_datetime(retry_after)
+            return max(0, (retry_date - datetime.now(timezone.utc))
+                       .total_seconds())
+        except (TypeError, ValueError):
+            pass
+    return random.uniform(0, min(max_delay, backoff * 2 ** attempt))
+
+
+def is_expired_error(exception):
+    """Check whether a download failed because its URL has expired.
+
+    Parameters
+    ----------
+    exception : Exception
+        Exception raised by a download, of `requests` or `aiohttp`.
+
+    Returns
+    -------
+    bool
+        Return True if the response status is one of
+        `EXPIRED_STATUS_CODES`, False otherwise.
+
+    """
+    response = getattr(exception, "response", None)
+    status = getattr(response, "status_code",
+                     getattr(exception, "status", None))
+    return status in EXPIRED_STATUS_CODES
+
+
+def build_dump_filepath(filelocation, base_filename,
+                        compression=FBCompression.NONE):
+    """Build the filepath of a JSON dump.
+
+    Parameters
+    ----------
+    filelocation : str
+        Folder where the JSON dump is saved.
+    base_filename : str
+        base_filename of the JSON dump (e.g. 'complete').
+    compression : FBCompression, optional
+        Compression of the JSON dump. The default is `FBCompression.NONE`.
+
+    Returns
+    -------
+    str
+        Return the filepath.
+
+    """
+    filepath = filelocation + base_filename + ".json"
+    if compression != FBCompression.NONE:
+        filepath += "." + compression.value
+    return filepath
+
+
+def find_dump_filepath(filelocation, base_filename):
+    """Find the filepath of an existing JSON dump, whatever its compression.
+
+    Parameters
+    ----------
+    filelocation : str
+        Folder where the JSON dump is saved.
+    base_filename : str
+        base_filename of the JSON dump (e.g. 'complete').
+
+    Returns
+    -------
+    str
+        Return the filepath. If any found, return None.
+
+    """
+    for compression in FBCompression:
+        filepath = build_dump_filepath(filelocation, base_filename,
+                                       compression)
+        if os.path.isfile(filepath):
+            return filepath
+    return None
+
+
+def open_dump(filepath, mode='r'):
+    """Open a JSON dump, transparently handling its compression.
+
+    Parameters
+    ----------
+    filepath : str
+        Filepath of the JSON dump. The compression is guessed from
+        its extension.
+    mode : str, optional
+        'r' for reading or 'w' for writing. The default is 'r'.
+
+    Returns
+    -------
+    file object
+        Return the text file object.
+
+    """
+    if filepath.endswith("." + FBCompression.GZIP.value):
+        return gzip.open(filepath, mode + 't', encoding='utf-8')
+    if filepath.endswith("." + FBCompression.XZ.value):
+        return lzma.open(filepath, mode + 't', encoding='utf-8')
+    return open(filepath, mode)
+
+
+def build_dump_index_filepath(filepath):
+    """Build the filepath of the offset index of an uncompressed JSON dump.
+
+    Parameters
+    ----------
+    filepath : str
+        Filepath of the JSON dump (e.g. 'complete.json').
+
+    Returns
+    -------
+    str
+        Return the filepath of the index (e.g. 'complete.idx.json').
+
+    """
+    return os.path.splitext(filepath)[0] + ".idx.json"
+
+
+def write_dump_index(filepath, buckets):
+    """Save the offset index of an uncompressed JSON dump.
+
+    Parameters
+    ----------
+    filepath : str
+        Filepath of the JSON dump, already written.
+    buckets : list
+        Pairs of [bucket, offset]: for each bucket of
+        `DUMP_INDEX_BUCKET_SIZE` ms (timestamp // DUMP_INDEX_BUCKET_SIZE),
+        the byte offset of the first message of the dump inside it or a
+        later bucket. Buckets without messages are omitted.
+
+    """
+    index_filepath = build_dump_index_filepath(filepath)
+    with open(index_filepath + ".tmp", 'w') as f:
+        json.dump({"bucket_size": DUMP_INDEX_BUCKET_SIZE,
+                   "size": os.path.getsize(filepath),
+                   "buckets": buckets}, f)
+    os.replace(index_filepath + ".tmp", index_filepath)
+
+
+def read_dump_index(filepath):
+    """Load the offset index of an uncompressed JSON dump.
+
+    Parameters
+    ----------
+    filepath : str
+        Filepath of the JSON dump.
+
+    Returns
+    -------
+    list
+        Return the [bucket, offset] pairs saved by `write_dump_index`. If
+        the index does not exist or does not match the dump anymore (e.g.
+        the dump was rewritten without it), return None.
+
+    """
+    try:
+        with open(build_dump_index_filepath(filepath), 'r') as f:
+            index = json.load(f)
+    except FileNotFoundError:
+        return None
+    if (index["bucket_size"] != DUMP_INDEX_BUCKET_SIZE
+            or index["size"] != os.path.getsize(filepath)):
+        return None
+    return index["buckets"]
+
+
+class TimestampFormatter(object):
+    """Fast formatter of Facebook timestamps to local time strings.
+
+    Timestamps are formatted as '%Y-%m-%d %H:%M:%S', like `strftime`
+    would. The date and hour part is computed once per 15 minutes block
+    and cached, only the minutes and seconds are computed for each
+    timestamp.
+
+    Notes
+    -----
+    Timezone offsets are multiples of 15 minutes, therefore the local time
+    is linear inside a 15 minutes block, unless a daylight saving time
+    transition happens inside it. Such blocks, and blocks not starting on
+    a local quarter of an hour, are never cached and fall back to
+    `strftime`.
+
+    """
+
+    _block_size = 15 * 60
+    _max_cache_size = 4096
+
+    def __init__(self):
+        """__init__ method."""
+        self.cache = {}
+
+    def format(self, timestamp):
+        """Format a timestamp.
+
+        Parameters
+        ----------
+        timestamp : int
+            Facebook timestamp, in milliseconds.
+
+        Returns
+        -------
+        str
+            Return the formatted local time string.
+
+        """
+        seconds = int(timestamp // 1000)
+        block = seconds - seconds % self._block_size
+        cached = self.cache.get(block)
+        if cached is None:
+            block_date = datetime.fromtimestamp(block)
+            block_end = block + self._block_size - 1
+            if (block_date.minute % 15 or block_date.second
+                    or (datetime.fromtimestamp(block_end) - block_date)
+                    .total_seconds() != block_end - block):
+                return datetime.fromtimestamp(seconds) \
+                    .strftime('%Y-%m-%d %H:%M:%S')
+            if len(self.cache) >= self._max_cache_size:
+                self.cache.clear()
+            cached = (block_date.strftime('%Y-%m-%d %H:'), block_date.minute)
+            self.cache[block] = cached
+        elapsed = seconds - block
+        return "%s%02d:%02d" % (cached[0], cached[1] + elapsed // 60,
+                                elapsed % 60)
+
+
+def write_metadata_cache(filepath, convers, participants):
+    """Save conversations metadata to a cache file.
+
+    Parameters
+    ----------
+    filepath : str
+        Filepath of the cache file.
+    convers : dict
+        Conversations metadata as returned by
+        `FBDumper.get_all_convers_metadata`.
+    participants : dict
+        Participants names as returned by
+        `FBDumper.get_all_convers_metadata`.
+
+    """
+    cache = {"timestamp": time.time(), "participants": participants,
+             "convers": {}}
+    for c in convers:
+        cache["convers"][c] = dict(convers[c], type=convers[c]["type"].value)
+    with open(filepath + ".tmp", 'w') as f:
+        json.dump(cache, f)
+    os.replace(filepath + ".tmp", filepath)
+
+
+def read_metadata_cache(filepath, ttl=None):
+    """Load conversations metadata from a cache file.
+
+    Parameters
+    ----------
+    filepath : str
+        Filepath of the cache file.
+    ttl : float, optional
+        Time to live of the cache, in seconds. If None, the cache never
+        expires.
+
+    Returns
+    -------
+    tuple
+        Containing conversations and participants dictionnaries
+        (convers, participants). If the cache does not exist or is expired,
+        return None.
+
+    """
+    if not os.path.isfile(filepath):
+        return None
+    with open(filepath, 'r') as f:
+        cache = json.load(f)
+    if ttl is not None and time.time() - cache["timestamp"] > ttl:
+        return None
+    convers = {}
+    for c in cache["convers"]:
+        convers[c] = dict(cache["convers"][c],
+                          type=FBConversType(cache["convers"][c]["type"]))
+    return (convers, cache["participants"])
+
+
+def get_part_size(part_filelocation):
+    """Get the size of a partly downloaded file.
+
+    Parameters
+    ----------
+    part_filelocation : str
+        Path of the partly downloaded file (ending with `PART_EXTENSION`).
+
+    Returns
+    -------
+    int
+        Return the size of the file in bytes, 0 if it does not exist.
+
+    """
+    try:
+        return os.path.getsize(part_filelocation)
+    except OSError:
+        return 0
+
+
+def get_part_write_mode(offset, status, content_range):
+    """Get how to write the response of a download resumed with `Range`.
+
+    Parameters
+    ----------
+    offset : int
+        Size of the partly downloaded file, i.e. first byte requested.
+    status : int
+        HTTP status code of the response.
+    content_range : str
+        'Content-Range' header of the response. May be None.
+
+    Returns
+    -------
+    str
+        'ab' if the response continues the partly downloaded file, 'wb' if
+        it is the whole file. None if the partly downloaded file is already
+        complete.
+
+    Raises
+    ------
+    FBTransferError
+        When the response does not match the partly downloaded file. It
+        should then be removed.
+
+    """
+    match = re.match(r'bytes (?:(\d+)-\d+|\*)/(\d+)', content_range or "")
+    if status == 416:
+        if offset and match and int(match.group(2)) == offset:
+            return None
+        raise FBTransferError("Range not satisfiable for a {} bytes "
+                              "partly downloaded file".format(offset))
+    if status == 206:
+        if not offset or not match or match.group(1) is None \
+                or int(match.group(1)) != offset:
+            raise FBTransferError("Content-Range '{}' does not match a {} "
+                                  "bytes partly downloaded file"
+                                  .format(content_range, offset))
+        return 'ab'
+    return 'wb'
+
+
+def iter_json_array(f, chunk_size=JSON_READ_CHUNK_SIZE, in_array=False):
+    """Iterate over the elements of a top-level JSON array.
+
+    The file is read by chunks and elements are decoded one at a time, so
+    only one element is kept in memory whatever the size of the array.
+
+    Parameters
+    ----------
+    f : file object
+        Text file object containing a JSON array (compact or indented).
+    chunk_size : int, optional
+        Number of characters read from `f` at once.
+    in_array : bool, optional
+        If True, `f` is positioned inside the array at the start of an
+        element, instead of at its start. The default is False.
+
+    Yields
+    ------
+    object
+        Decoded elements of the array.
+
+    Raises
+    ------
+    ValueError
+        When the file is not a JSON array or is truncated.
+
+    """
+    decoder = json.JSONDecoder()
+    whitespace = re.compile(r'[ \t\n\r]*')
+    buffer = ""
+    pos = 0
+    is_eof = False
+    is_started = in_array
+    is_element_expected = True
+    has_elements = in_array
+    while True:
+        pos = whitespace.match(buffer, pos).end()
+        if pos == len(buffer) and not is_eof:
+            chunk = f.read(chunk_size)
+            is_eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        if pos == len(buffer):
+            raise ValueError("JSON array is truncated.")
+
+        if not is_started:
+            if buffer[pos] != "[":
+                raise ValueError("JSON data is not an array.")
+            is_started = True
+            pos += 1
+        elif buffer[pos] == "]" and (not is_element_expected
+                                     or not has_elements):
+            return
+        elif buffer[pos] == "," and not is_element_expected:
+            is_element_expected = True
+            pos += 1
+        elif not is_element_expected:
+            raise ValueError("JSON array is malformed, expecting ',' "
+                             "delimiter at position {}.".format(pos))
+        else:
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if is_eof:
+                    raise
+                end = len(buffer)
+            if not is_eof and (end == len(buffer)
+                               or buffer[end] not in ",] \t\n\r"):
+                chunk = f.read(chunk_size)
+                is_eof = not chunk
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            yield element
+            has_elements = True
+            is_element_expected = False
+            pos = end
+
+
+def iter_dump(filepath, since=None, until=None):
+    """Iterate over the messages of a JSON dump.
+
+    Parameters
+    ----------
+    filepath : str
+        Filepath of the JSON dump. It may be compressed
+        (see `open_dump`).
+    since : int, optional
+        Only the messages sent from this timestamp (in ms) are returned.
+    until : int, optional
+        Only the messages sent before this timestamp (in ms) are returned.
+
+    Yields
+    ------
+    dict
+        JSON Formatted Facebook messages.
+
+    Notes
+    -----
+    When a time range is given and the dump has an offset index (see
+    `write_dump_index`), the memory-mapped dump is decoded from the first
+    bucket of the range until its end only. Otherwise every message is
+    decoded and filtered.
+
+    """
+    buckets = None
+    if since is not None or until is not None:
+        buckets = read_dump_index(filepath)
+    if buckets is None:
+        with open_dump(filepath) as f:
+            for msg in iter_json_array(f):
+                if ((since is None or msg["timestamp"] >= since)
+                        and (until is None or msg["timestamp"] < until)):
+                    yield msg
+        return
+
+    i = 0
+    if since is not None:
+        i = bisect_left([b[0] for b in buckets],
+                        since // DUMP_INDEX_BUCKET_SIZE)
+    if i == len(buckets):
+        return
+    with open(filepath, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        mm.seek(buckets[i][1])
+        for msg in iter_json_array(codecs.getreader('utf-8')(mm),
+                                   in_array=True):
+            if until is not None and msg["timestamp"] >= until:
+                return
+            if since is None or msg["timestamp"] >= since:
+                yield msg
+
+
 def format_convers_metadata(convers, participants):
     """Format conversations metadata.
 
@@ -129,17 +828,18 @@ def format_convers_metadata(convers, participants):
     """
     metadata_fmt = "[+] - ID: '{}' - Name: '{}' - Last msg: '{}' - Type:" \
                    " '{}' - Status: '{}' - Users: '{}'\n"
+    timestamp_formatter = TimestampFormatter()
     formatted_metadata = ""
     for c in convers:
         current_convers = convers[c]
         users = ''.join([participants[u[5:]] + " | "
                          for u in current_convers["participants"]])
         users = users[:-len(" | ")]
-        last_msg_date = current_convers["last_message_timestamp"] / 1000
+        last_msg_date = timestamp_formatter.format(
+            current_convers["last_message_timestamp"])
         formatted_metadata += (metadata_fmt
                                .format(c, current_convers["name"],
-                                       datetime.fromtimestamp(last_msg_date)
-                                       .strftime('%Y-%m-%d %H:%M:%S'),
+                                       last_msg_date,
                                        current_convers["type"].value,
                                        current_convers["status"], users))
     return formatted_metadata.rstrip()
@@ -15,18 +15,31 @@ Examples
 import json
 import os
 import re
-from datetime import datetime
 from urllib import parse
 
-import requests
+from collections import Counter
 from concurrent import futures
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future, ProcessPoolExecutor, \
+                               ThreadPoolExecutor
+from functools import partial
+from itertools import chain, count
+from queue import PriorityQueue, SimpleQueue
+from requests.exceptions import RequestException
 from unidecode import unidecode
 
+from fbscraper.aiodl import FBAsyncDownloader
 from fbscraper.dumper import FBDumper
-from fbscraper.lib import FBDataTypes, FBParserMode, PrintLoading, \
+from fbscraper.lib import FBDataTypes, FBDownloadEngine, FBParserMode, \
+                          FBTransferError, PrintLoading, RateLimiter, \
                           OUTPUT_DEFAULT_FOLDER, \
-                          format_convers_metadata
+                          METADATA_CACHE_FILENAME, PART_EXTENSION, \
+                          TimestampFormatter, \
+                          format_convers_metadata, get_part_size, \
+                          get_part_write_mode, is_expired_error, iter_dump, \
+                          read_metadata_cache
+from fbscraper.search import FBSearchIndex
+from fbscraper.store import FBMediaStore
+from fbscraper.transport import FBTransport
 
 
 class FBParser(object):
@@ -37,6 +50,10 @@ class FBParser(object):
     summary_report_fmt : str
         Format string used for displaying a summary of all data reports.
         May be changed to suit your need.
+    global_summary_report_fmt : str
+        Format string used for displaying a summary of all data reports of
+        all files parsed using several processes.
+        May be changed to suit your need.
     message_fmt : str
         Format string used for storing messages.
         May be changed to suit your need.
@@ -45,28 +62,112 @@ class FBParser(object):
     ----------
     user_raw_data: dict
         User raw POST data used for getting conversations metadata
-        (using `FBDumper`).
+        (using `FBDumper`). May be None when `offline` is True.
     json_msgs : dict, optional
         JSON conversation
     infile_json : str, optional
         Filepath from where to load the JSON conversation.
+    db : FBDatabase, optional
+        SQLite message store from where to load every conversation saved.
+        When neither messages nor links are retrieved, only the messages
+        with attachments of the retrieved types are loaded, using its
+        indexes.
+    dumper : FBDumper, optional
+        Dumper from where to stream every conversation it dumps (see
+        `FBDumper.iter_convers`): messages are parsed and downloads start
+        while next pages are still requested. Its conversations metadata
+        are used.
+    save_dump : bool, optional
+        If True, the JSON dumps of the conversations streamed from `dumper`
+        are also written. The default is False.
     mode : FBParserMode, optional
         Mode to use. The default is `FBParserMode.REPORT`.
     data : FBDataTypes, optional
         Data types to retrieve. The default is `FBDataTypes.ALL`.
     threads : int, optional
-        Number of threads to use for DL mode. The default is 4.
+        Number of threads to use for DL mode. The default is 4. With the
+        `FBDownloadEngine.ASYNC` engine, it is the number of concurrent
+        transfers.
     output : str, optional
        Folder output where to save data. May be common between
        conversations dumped or parsed.
+    cache_ttl : float, optional
+        Time to live in seconds of the conversations metadata cache
+        (see `FBDumper`). The default is 0 (the cache is never used).
+    offline : bool, optional
+        If True, conversations metadata are only loaded from the cache
+        inside `output`, whatever its age, and no request is made to
+        Facebook for it. The default is False.
+    processes : int, optional
+        Number of processes parsing `infile_json` files concurrently.
+        The default is 1.
+    convers : dict, optional
+        Conversations metadata as returned by
+        `FBDumper.get_all_convers_metadata`. If provided with
+        `participants`, metadata are neither requested nor loaded from
+        the cache.
+    participants : dict, optional
+        Participants names as returned by
+        `FBDumper.get_all_convers_metadata`.
+    engine : FBDownloadEngine, optional
+        Download engine used for DL mode. The default is
+        `FBDownloadEngine.THREADS`.
+    limit_per_host : int, optional
+        Maximum number of connections opened to the same host by the
+        `FBDownloadEngine.ASYNC` engine. The default is 16.
+    store : str, optional
+        Folder of a `FBMediaStore` where to download files in DL mode,
+        conversation folders then contain links to it. The default is None
+        (files are downloaded inside conversation folders).
+    queue_size : int, optional
+        Maximum number of downloads submitted and not handled yet in DL
+        mode. Parsing pauses while it is reached. The default is 1000.
+    priorities : list of FBDataTypes, optional
+        Data types to download first in DL mode, in this order. Other
+        types are downloaded after them. The default is None (downloads
+        are made in the order they are parsed).
+    smallest_first : bool, optional
+        If True, the size of each file is probed with a HEAD request and
+        files of a same priority are downloaded from the smallest to the
+        biggest in DL mode. The default is False.
+    max_rate : float, optional
+        Global bandwidth cap of DL mode, in bytes per second. With
+        several `processes`, each one has its own cap. The default is None
+        (no cap).
+    retries : int, optional
+        Number of retries of a failed request or download. The default
+        is 3.
+    backoff : float, optional
+        Base delay in seconds of the exponential backoff between retries.
+        The default is 1.
+    refresh_expired : bool, optional
+        If True, downloads which failed because their URL has expired are
+        retried in DL mode with fresh URLs, requested from Facebook for
+        the messages containing them only. The default is False.
+    index : str, optional
+        Filepath of a `FBSearchIndex` where to add the bodies of the
+        messages parsed, in any mode. The default is None (no index).
+    since : int, optional
+        Only the messages of `infile_json` or `db` sent from this
+        timestamp (in ms) are parsed. The default is None.
+    until : int, optional
+        Only the messages of `infile_json` or `db` sent before this
+        timestamp (in ms) are parsed. The default is None.
 
     Raises
     ------
     ValueError
-        When both a `json_msgs` or a `infile_json` are provided.
+        When not exactly one of `json_msgs`, `infile_json`, `db` or
+        `dumper` is provided.
 
         When the number of `threads` is inferior or equal to 0.
 
+        When the number of `processes` is inferior or equal to 0.
+
+        When the `queue_size` is inferior or equal to 0.
+
+        When `offline` is True and no metadata cache is found.
+
     See Also
     --------
     FBDumper :Used for getting all conversations
@@ -74,6 +175,10 @@ class FBParser(object):
 
     Notes
     -----
+    Messages streamed from a `dumper` are parsed page by page, from the
+    newest page to the oldest one, so reports are not in chronological
+    order.
+
     Conversations parsed must have their metadata dumpable. To do so,
     try to parse only conversations that is related to `user_raw_data`
     parameter cookie.
@@ -83,6 +188,10 @@ class FBParser(object):
     summary_report_fmt = "[+]     - Data report : {} messages, {} pictures, " \
                          "{} gifs, {} videos, {} files, {} links parsed"
 
+    global_summary_report_fmt = "[+] - Global data report : {}/{} files " \
+                                "parsed, {} messages, {} pictures, {} gifs, " \
+                                "{} videos, {} files, {} links parsed"
+
     message_fmt = "Message body: {} - attachments {{{}}} - sent by: '{}' " \
                   "({}) - the {}\n"
 
@@ -91,22 +200,43 @@ class FBParser(object):
     _regex_username = r'<title id="pageTitle">(.*?)</title>'
     _bad_page_title = "Page introuvable | Facebook"
     _action_type_user_msg = "ma-type:user-generated-message"
+    _report_buffer_size = 64 * 1024
+    _expired_filename = "expired.json"
+    _completed_filename = "downloads.json"
+    _dl_url_keys = {FBDataTypes.PICTURES: "preview_url",
+                    FBDataTypes.GIFS: "preview_url",
+                    FBDataTypes.VIDEOS: "url",
+                    FBDataTypes.FILES: "url"}
+    _regex_get_url_from_uri = re.compile(
+        r"https:\/\/l.facebook.com\/l.php.u=(.*?)&h=")
 
     def __init__(self, user_raw_data, json_msgs=None, infile_json=None,
                  mode=FBParserMode.REPORT, data=FBDataTypes.ALL,
-                 threads=4, output=OUTPUT_DEFAULT_FOLDER):
+                 threads=4, output=OUTPUT_DEFAULT_FOLDER, cache_ttl=0,
+                 offline=False, processes=1, convers=None,
+                 participants=None, engine=FBDownloadEngine.THREADS,
+                 limit_per_host=16, store=None, queue_size=1000,
+                 priorities=None, smallest_first=False, max_rate=None,
+                 retries=3, backoff=1, refresh_expired=False, db=None,
+                 index=None, since=None, until=None, dumper=None,
+                 save_dump=False):
         """__init__ method."""
-        if bool(json_msgs) ^ bool(infile_json):
-            if json_msgs:
-                self.json_msgs = json_msgs
-            else:
-                self.infile_json = infile_json
-        else:
+        if [bool(json_msgs), bool(infile_json), db is not None,
+                dumper is not None].count(True) != 1:
             raise ValueError('You should either provide a JSON dict'
-                             '`json_msgs` or a filepath as `infile_json`.')
-
+                             '`json_msgs`, a filepath as `infile_json`, '
+                             'a database as `db` or a `dumper`.')
+        self.json_msgs = json_msgs if json_msgs else None
+        self.infile_json = infile_json if infile_json else None
+        self.db = db
+        self.dumper = dumper
+        self.save_dump = save_dump
+        self.since = since
+        self.until = until
+
+        self.user_raw_data = user_raw_data
         self.mode = mode
-        self.data = data
+        self.data = [data] if isinstance(data, FBDataTypes) else data
         self.output = os.path.join(output, '')
         os.makedirs(self.output, exist_ok=True)
 
@@ -114,17 +244,83 @@ class FBParser(object):
             raise ValueError('Thread parameter must be superrior to 0. '
                              'Value : {}'.format(threads))
         self.threads = threads
-
-        fb_dumper = FBDumper("", user_raw_data, chunk_size=2000, output=output)
-
-        self.convers = fb_dumper.convers
-        self.participants = fb_dumper.participants
-
+        self.timestamp_formatter = TimestampFormatter()
+
+        if processes <= 0:
+            raise ValueError('Processes parameter must be superior to 0. '
+                             'Value : {}'.format(processes))
+        self.processes = processes
+        self.print_loading = True
+        self.to_stdout = False
+        self.verbose = False
+
+        if queue_size <= 0:
+            raise ValueError('Queue size parameter must be superior to 0. '
+                             'Value : {}'.format(queue_size))
+        self.queue_size = queue_size
+
+        self.retries = retries
+        self.backoff = backoff
+        # With several processes, the transport and the download engine
+        # are only built inside workers (see `_init_worker_parser`).
+        in_processes = bool(self.infile_json) and processes > 1
+        self.transport = None if in_processes \
+            else FBTransport(pool_size=threads, retries=retries,
+                             backoff=backoff)
+        if dumper is not None:
+            self.convers = dumper.convers
+            self.participants = dumper.participants
+        elif convers is not None and participants is not None:
+            self.convers = convers
+            self.participants = participants
+        elif offline:
+            cached_metadata = read_metadata_cache(self.output
+                                                  + METADATA_CACHE_FILENAME)
+            if cached_metadata is None:
+                raise ValueError('No conversations metadata cache found '
+                                 'inside {}. Run the dumper or the parser '
+                                 'once online.'.format(self.output))
+            self.convers, self.participants = cached_metadata
+        else:
+            fb_dumper = FBDumper("", user_raw_data, chunk_size=2000,
+                                 output=output, transport=self.transport,
+                                 cache_ttl=cache_ttl)
+
+            self.convers = fb_dumper.convers
+            self.participants = fb_dumper.participants
+            if self.transport is None:
+                fb_dumper.transport.close()
+
+        self.engine = engine
+        self.limit_per_host = limit_per_host
+        self.executor = None
+        self.downloader = None
+        self.store_location = store
+        self.store = None
+        self.refresh_expired = refresh_expired
+        self.priorities = priorities or []
+        self.smallest_first = smallest_first
+        self.max_rate = max_rate
+        self.rate_limiter = None
+        self.index_location = index
+        self.search_index = FBSearchIndex(index) if index else None
         if self.mode == FBParserMode.DL:
-            self.executor = ThreadPoolExecutor(max_workers=threads)
+            if store:
+                self.store = FBMediaStore(store)
+            if max_rate:
+                self.rate_limiter = RateLimiter(max_rate, capacity=max_rate)
+            if self.engine == FBDownloadEngine.THREADS:
+                self.download_jobs = PriorityQueue()
+                self.download_jobs_cnt = count()
             self.futures = {}
-        else:
-            self.executor = None
+            self.futures_convers = {}
+            self.futures_sources = {}
+            self.convers_paths = set()
+            self.downloading_paths = set()
+            self.expired = {}
+            self.completed = {}
+            self.remaining_convers = Counter()
+            self.completed_futures = SimpleQueue()
 
     def init_parser_for_next(self, infile_json):
         """Init the instance attributes for parsing the `infile_json` file.
@@ -132,30 +328,63 @@ class FBParser(object):
         Parameters
         ----------
         infile_json : str
-            Filepath from where to load the JSON conversation.
+            Filepath from where to load the JSON conversation. It may be
+            compressed (see `FBCompression`).
+
+        Returns
+        -------
+        bool
+            Return False if no message was sent between `self.since` and
+            `self.until`, True otherwise.
+
+        Raises
+        ------
+        ValueError
+            When the file does not contain any message.
+
+        Notes
+        -----
+        Messages are not loaded at once, `self.json_msgs` is an iterator
+        reading them one at a time from the file while parsing.
 
         """
-        with open(infile_json, 'r') as f:
-            self.json_msgs = json.load(f)
-        self.convers_id = self.get_conversation_id()
-        self.output_convers = os.path.join(self.output, self.convers_id + " - "
-                                           + unidecode(self.convers[
-                                               self.convers_id]
-                                               ["name"]),
-                                           '')
+        msgs = iter_dump(infile_json, self.since, self.until)
+        first_msg = next(msgs, None)
+        if first_msg is None:
+            if self.since is not None or self.until is not None:
+                return False
+            raise ValueError("JSON file '{}' does not contain any message."
+                             .format(infile_json))
+        self.json_msgs = chain([first_msg], msgs)
+        self.init_convers(first_msg)
+        return True
+
+    def init_convers(self, first_msg=None):
+        """Init the instance attributes for parsing `self.json_msgs`.
+
+        The output folder of the conversation is created and reports are
+        opened inside it.
+
+        Parameters
+        ----------
+        first_msg : dict, optional
+            First message of the conversation. If None, it is
+            `self.json_msgs[0]`.
+
+        """
+        self.convers_id = self.get_conversation_id(first_msg)
+        self.output_convers = self.build_output_convers(self.convers_id)
         os.makedirs(self.output_convers, exist_ok=True)
         if self.mode == FBParserMode.DL:
+            self.convers_paths = set()
+            if os.path.isfile(self.output_convers + self._expired_filename):
+                os.remove(self.output_convers + self._expired_filename)
             for e in FBDataTypes:
                 if (e != FBDataTypes.ALL and e != FBDataTypes.MESSAGES
                         and e != FBDataTypes.LINKS):
                     os.makedirs(self.output_convers + e.value, exist_ok=True)
 
-        self.msgs = ""
-        self.pics = ""
-        self.gifs = ""
-        self.videos = ""
-        self.files = ""
-        self.links = ""
+        self.open_reports()
         self.cnt_msgs = 0
         self.cnt_pics = 0
         self.cnt_gifs = 0
@@ -163,11 +392,16 @@ class FBParser(object):
         self.cnt_files = 0
         self.cnt_links = 0
         self.quit = False
-        self.futures = {}
 
-    def get_conversation_id(self):
+    def get_conversation_id(self, msg=None):
         """Extract conversation id from `self.json_msgs`.
 
+        Parameters
+        ----------
+        msg : dict, optional
+            Message from which extracting the conversation id. If None,
+            it is `self.json_msgs[0]`.
+
         Returns
         -------
         str
@@ -179,13 +413,15 @@ class FBParser(object):
             JSON data seems malformed, can not access specific key.
 
         """
+        if msg is None:
+            msg = self.json_msgs[0]
         user = "other_user_fbid"
         group = "thread_fbid"
-        if self.json_msgs[0][user] is not None:
-            return self.json_msgs[0][user]
+        if msg[user] is not None:
+            return msg[user]
 
-        if self.json_msgs[0][group] is not None:
-            return self.json_msgs[0][group]
+        if msg[group] is not None:
+            return msg[group]
 
         raise ValueError("JSON data seems malformed. Can't retrieve the"
                          "conversation ID. Verify your JSON input file."
@@ -231,16 +467,14 @@ class FBParser(object):
 
         fbid = msg["author"][5:]
         username = self.participants[fbid] if fbid in self.participants else ""
-        self.msgs += self.message_fmt.format(repr(msg["body"]), attachments,
-                                             username, fbid,
-                                             datetime.fromtimestamp(
-                                                msg["timestamp"] / 1000)
-                                             .strftime('%Y-%m-%d %H:%M:%S'))
+        self.msgs.write(self.message_fmt.format(
+            repr(msg["body"]), attachments, username, fbid,
+            self.timestamp_formatter.format(msg["timestamp"])))
 
         self.cnt_msgs += 1
 
-    def check_and_get_pics(self, msg):
-        """Check if msg is containing pictures and stored it in self.pics.
+    def index_msg(self, msg):
+        """Add msg to the search index `self.search_index`.
 
         Parameters
         ----------
@@ -248,24 +482,22 @@ class FBParser(object):
             JSON Formatted Facebook message.
 
         """
-        for attachment in msg["attachments"]:
-            if (attachment["attach_type"] == "photo" and
-                    attachment["preview_url"] is not None):
+        fbid = msg["author"][5:]
+        self.search_index.add_message(self.convers_id, msg,
+                                      self.participants.get(fbid, ""))
 
-                if (self.mode == FBParserMode.REPORT
-                        or self.mode == FBParserMode.DL):
-                    self.pics += attachment["preview_url"] + "\n"
+    def check_and_get_pics(self, msg):
+        """Check if msg is containing pictures and stored it in self.pics.
 
-                if self.mode == FBParserMode.DL:
-                    dl_path = self.output_convers \
-                        + FBDataTypes.PICTURES.value \
-                        + os.sep + attachment["name"]
-                    self.futures[self.executor.
-                                 submit(self.dl_file,
-                                        attachment["preview_url"],
-                                        dl_path)] = attachment["preview_url"]
+        Parameters
+        ----------
+        msg : dict
+            JSON Formatted Facebook message.
 
-                self.cnt_pics += 1
+        """
+        for attachment in msg["attachments"]:
+            if attachment["attach_type"] == "photo":
+                self.get_pic(attachment)
 
     def check_and_get_gifs(self, msg):
         """Check if msg is containing gifs and stored it in self.gifs.
@@ -277,23 +509,8 @@ class FBParser(object):
 
         """
         for attachment in msg["attachments"]:
-            if (attachment["attach_type"] == "animated_image" and
-                    attachment["preview_url"] is not None):
-
-                if (self.mode == FBParserMode.REPORT
-                        or self.mode == FBParserMode.DL):
-                    self.gifs += attachment["preview_url"] + "\n"
-
-                if self.mode == FBParserMode.DL:
-                    dl_path = self.output_convers \
-                        + FBDataTypes.GIFS.value + os.sep \
-                        + attachment["name"]
-                    self.futures[self.executor.
-                                 submit(self.dl_file,
-                                        attachment["preview_url"],
-                                        dl_path)] = attachment["preview_url"]
-
-                self.cnt_gifs += 1
+            if attachment["attach_type"] == "animated_image":
+                self.get_gif(attachment)
 
     def check_and_get_videos(self, msg):
         """Check if msg is containing videos and stored it in self.videos.
@@ -305,23 +522,8 @@ class FBParser(object):
 
         """
         for attachment in msg["attachments"]:
-            if (attachment["attach_type"] == "video" and
-                    attachment["url"] is not None):
-
-                if (self.mode == FBParserMode.REPORT
-                        or self.mode == FBParserMode.DL):
-                    self.videos += attachment["url"] + "\n"
-
-                if self.mode == FBParserMode.DL:
-                    dl_path = self.output_convers \
-                        + FBDataTypes.VIDEOS.value + os.sep \
-                        + attachment["name"]
-                    self.futures[self.executor.
-                                 submit(self.dl_file,
-                                        attachment["url"],
-                                        dl_path)] = attachment["url"]
-
-                self.cnt_videos += 1
+            if attachment["attach_type"] == "video":
+                self.get_video(attachment)
 
     def check_and_get_files(self, msg):
         """Check if msg is containing files and stored it in self.files.
@@ -333,23 +535,8 @@ class FBParser(object):
 
         """
         for attachment in msg["attachments"]:
-            if (attachment["attach_type"] == "file"
-                    and attachment["url"] is not None):
-
-                if (self.mode == FBParserMode.REPORT
-                        or self.mode == FBParserMode.DL):
-                    self.files += attachment["url"] + "\n"
-
-                if self.mode == FBParserMode.DL:
-                    dl_path = self.output_convers \
-                        + FBDataTypes.FILES.value + os.sep \
-                        + attachment["name"]
-                    self.futures[self.executor.
-                                 submit(self.dl_file,
-                                        attachment["url"],
-                                        dl_path)] = attachment["url"]
-
-                self.cnt_files += 1
+            if attachment["attach_type"] == "file":
+                self.get_file(attachment)
 
     def check_and_get_links(self, msg):
         """Check if msg is containing links and stored it in self.links.
@@ -360,26 +547,372 @@ class FBParser(object):
             JSON Formatted Facebook message.
 
         """
-        regex_get_url_from_uri = "https:\/\/l.facebook.com\/l.php.u=(.*?)&h="
-
         for attachment in msg["attachments"]:
-            if (attachment["attach_type"] == "share" and
-                    attachment["share"]["uri"] is not None):
+            if attachment["attach_type"] == "share":
+                self.get_link(attachment)
+        self.get_ranges(msg)
 
-                match = re.search(regex_get_url_from_uri,
-                                  attachment["share"]["uri"])
-                if match is not None:
-                    self.links += parse.unquote(match.group(1)) + "\n"
-                else:
-                    self.links += attachment["share"]["uri"] + "\n"
+        return 0
 
-                self.cnt_links += 1
+    def get_pic(self, attachment):
+        """Store a picture attachment in self.pics.
+
+        Parameters
+        ----------
+        attachment : dict
+            JSON Formatted Facebook attachment of 'photo' type.
+
+        """
+        if attachment["preview_url"] is not None:
+            self.pics.write(attachment["preview_url"] + "\n")
+            if self.mode == FBParserMode.DL:
+                self.submit_download(attachment["preview_url"],
+                                     FBDataTypes.PICTURES,
+                                     attachment["name"])
+            self.cnt_pics += 1
+
+    def get_gif(self, attachment):
+        """Store a gif attachment in self.gifs.
+
+        Parameters
+        ----------
+        attachment : dict
+            JSON Formatted Facebook attachment of 'animated_image' type.
+
+        """
+        if attachment["preview_url"] is not None:
+            self.gifs.write(attachment["preview_url"] + "\n")
+            if self.mode == FBParserMode.DL:
+                self.submit_download(attachment["preview_url"],
+                                     FBDataTypes.GIFS, attachment["name"])
+            self.cnt_gifs += 1
+
+    def get_video(self, attachment):
+        """Store a video attachment in self.videos.
+
+        Parameters
+        ----------
+        attachment : dict
+            JSON Formatted Facebook attachment of 'video' type.
+
+        """
+        if attachment["url"] is not None:
+            self.videos.write(attachment["url"] + "\n")
+            if self.mode == FBParserMode.DL:
+                self.submit_download(attachment["url"], FBDataTypes.VIDEOS,
+                                     attachment["name"])
+            self.cnt_videos += 1
+
+    def get_file(self, attachment):
+        """Store a file attachment in self.files.
+
+        Parameters
+        ----------
+        attachment : dict
+            JSON Formatted Facebook attachment of 'file' type.
+
+        """
+        if attachment["url"] is not None:
+            self.files.write(attachment["url"] + "\n")
+            if self.mode == FBParserMode.DL:
+                self.submit_download(attachment["url"], FBDataTypes.FILES,
+                                     attachment["name"])
+            self.cnt_files += 1
+
+    def get_link(self, attachment):
+        """Store a shared link attachment in self.links.
+
+        Parameters
+        ----------
+        attachment : dict
+            JSON Formatted Facebook attachment of 'share' type.
+
+        """
+        if attachment["share"]["uri"] is not None:
+            match = self._regex_get_url_from_uri.search(
+                attachment["share"]["uri"])
+            if match is not None:
+                self.links.write(parse.unquote(match.group(1)) + "\n")
+            else:
+                self.links.write(attachment["share"]["uri"] + "\n")
+
+            self.cnt_links += 1
+
+    def get_ranges(self, msg):
+        """Store links found inside the body of msg in self.links.
+
+        Parameters
+        ----------
+        msg : dict
+            JSON Formatted Facebook message.
+
+        """
         if "ranges" in msg:
             for link_range in msg["ranges"]:
-                self.links += link_range["entity"]["url"] + "\n"
+                self.links.write(link_range["entity"]["url"] + "\n")
                 self.cnt_links += 1
 
-        return 0
+    def submit_download(self, url, data_type, name, filename=None):
+        """Submit the download of an attachment to the download engine.
+
+        Parameters
+        ----------
+        url : str
+           URL where to download the file.
+        data_type : FBDataTypes
+            Data type of the attachment, used as download folder.
+        name : str
+            Filename of the attachment.
+        filename : str, optional
+            Filename where to save the attachment. If None, it is claimed
+            from `name` (see `claim_filename`).
+
+        Notes
+        -----
+        Files already downloaded are skipped. A file is known as completely
+        downloaded when its size is the one recorded when its download
+        completed (see `get_completed`). Other existing files (e.g. left
+        truncated by an interrupted download) are resumed like partly
+        downloaded files, so the server tells whether bytes are missing.
+
+        With a media store, the file is downloaded inside the store, unless
+        the URL is already known, and `dl_path` is linked to it.
+
+        While `self.queue_size` downloads are pending, completed ones are
+        waited and handled before submitting, so the memory used by
+        pending downloads stays bounded.
+
+        Pending downloads are started by priority of their data type (see
+        `self.priorities`), then by size with `self.smallest_first`.
+
+        """
+        if filename is None:
+            filename = name if self.store \
+                else self.claim_filename(data_type, name)
+        dl_path = self.output_convers + data_type.value + os.sep + filename
+        on_complete = None
+        if self.store:
+            if not self.store.reserve(url, dl_path):
+                return
+            on_complete = partial(self.store.add, url,
+                                  self.store.build_incoming_path(url))
+            dl_path = self.store.build_incoming_path(url)
+        elif os.path.isfile(dl_path):
+            size = self.get_completed(self.convers_id).get(
+                data_type.value + os.sep + filename)
+            if size == os.path.getsize(dl_path):
+                return
+            os.replace(dl_path, dl_path + PART_EXTENSION)
+        if not self.downloader and not self.executor:
+            self.start_download_engine()
+        while len(self.futures) >= self.queue_size:
+            self.handle_download(self.completed_futures.get())
+        if not self.store:
+            self.downloading_paths.add(dl_path)
+        if data_type in self.priorities:
+            priority = self.priorities.index(data_type)
+        else:
+            priority = len(self.priorities)
+        if self.downloader:
+            future = self.downloader.submit(url, dl_path, on_complete,
+                                            priority)
+        else:
+            future = Future()
+            size = -1 if self.smallest_first else 0
+            self.download_jobs.put(((priority, size),
+                                    next(self.download_jobs_cnt), future,
+                                    url, dl_path, on_complete))
+            self.executor.submit(self.dl_next_file)
+        self.futures[future] = url
+        self.futures_convers[future] = self.convers_id
+        self.futures_sources[future] = (data_type, name, filename,
+                                        self.current_msg["message_id"],
+                                        self.current_msg["timestamp"])
+        self.remaining_convers[self.convers_id] += 1
+        future.add_done_callback(self.completed_futures.put)
+
+    def claim_filename(self, data_type, name):
+        """Claim the filename where to save an attachment.
+
+        Parameters
+        ----------
+        data_type : FBDataTypes
+            Data type of the attachment, used as download folder.
+        name : str
+            Filename of the attachment.
+
+        Returns
+        -------
+        str
+            Return `name`. When it is already claimed by another attachment
+            of the conversation, or being downloaded, " (1)", " (2)"... is
+            appended to it, like `FBMediaStore.link` does.
+
+        Notes
+        -----
+        Attachments are claimed in the order they are parsed, so a same
+        filename is given to each of them by every parse.
+
+        """
+        folder = self.output_convers + data_type.value + os.sep
+        root, ext = os.path.splitext(name)
+        filename = name
+        cnt = 0
+        while (folder + filename in self.convers_paths
+               or folder + filename in self.downloading_paths):
+            cnt += 1
+            filename = "{} ({}){}".format(root, cnt, ext)
+        self.convers_paths.add(folder + filename)
+        return filename
+
+    def start_download_engine(self):
+        """Start the download engine, when the first download is submitted.
+
+        Notes
+        -----
+        The async engine runs its own event loop thread, so parsers which
+        never download (e.g. the parent process of `parse_in_processes`)
+        do not start it.
+
+        """
+        if self.engine == FBDownloadEngine.ASYNC:
+            self.downloader = FBAsyncDownloader(
+                concurrency=self.threads,
+                limit_per_host=self.limit_per_host,
+                smallest_first=self.smallest_first,
+                rate_limiter=self.rate_limiter, retries=self.retries,
+                backoff=self.backoff,
+                circuit_breaker=self.transport.circuit_breaker)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=self.threads)
+
+    def handle_download(self, future):
+        """Handle a completed download and drop its future.
+
+        Parameters
+        ----------
+        future : concurrent.futures.Future
+            Future of a download submitted by `submit_download`.
+
+        Notes
+        -----
+        if `self.to_stdout` is False, exceptions won't be printed but
+        threw.
+
+        Downloads which failed because their URL has expired are recorded
+        inside `self.expired` instead (see `refresh_expired_downloads`).
+
+        """
+        url = self.futures.pop(future)
+        convers_id = self.futures_convers.pop(future)
+        data_type, name, filename, message_id, timestamp = \
+            self.futures_sources.pop(future)
+        self.remaining_convers[convers_id] -= 1
+        key = data_type.value + os.sep + filename
+        dl_path = self.build_output_convers(convers_id) + key
+        self.downloading_paths.discard(dl_path)
+        try:
+            future.result()
+            if not self.store and os.path.isfile(dl_path):
+                self.get_completed(convers_id)[key] = os.path.getsize(
+                    dl_path)
+            if self.to_stdout and self.verbose:
+                print("[+]     - File '" + url + "' saved")
+        except Exception as e:
+            if self.store:
+                self.store.release(url)
+            if is_expired_error(e):
+                self.expired.setdefault(convers_id, []).append(
+                    {"url": url, "data_type": data_type.value,
+                     "name": name, "filename": filename,
+                     "message_id": message_id,
+                     "timestamp": timestamp})
+                if self.to_stdout and self.verbose:
+                    print("[+]     - File '" + url + "' has expired")
+            elif self.to_stdout:
+                print("[+]     - File '" + url
+                      + "' generated an exception: " + str(e))
+            else:
+                raise e
+        if (not self.remaining_convers[convers_id]
+                and convers_id != self.convers_id):
+            self.print_downloads_finished(convers_id)
+
+    def get_completed(self, convers_id):
+        """Get the sizes of the completed downloads of a conversation.
+
+        Parameters
+        ----------
+        convers_id : str
+            Conversation ID.
+
+        Returns
+        -------
+        dict
+            Return the size of each completely downloaded file, by path
+            relative to the conversation folder. It is loaded from the
+            `downloads.json` file of the conversation folder the first
+            time, and saved by `print_downloads_finished`.
+
+        """
+        if convers_id not in self.completed:
+            filepath = (self.build_output_convers(convers_id)
+                        + self._completed_filename)
+            if os.path.isfile(filepath):
+                with open(filepath, 'r') as f:
+                    self.completed[convers_id] = json.load(f)
+            else:
+                self.completed[convers_id] = {}
+        return self.completed[convers_id]
+
+    def print_downloads_finished(self, convers_id):
+        """Print that the downloads of a conversation are all finished.
+
+        The sizes of its completed downloads are saved (see
+        `get_completed`).
+
+        """
+        del self.remaining_convers[convers_id]
+        if convers_id in self.completed:
+            filepath = (self.build_output_convers(convers_id)
+                        + self._completed_filename)
+            with open(filepath + ".tmp", 'w') as f:
+                json.dump(self.completed.pop(convers_id), f, sort_keys=True)
+            os.replace(filepath + ".tmp", filepath)
+        if self.to_stdout:
+            print("[+]     - Downloads of conversation '{}' finished"
+                  .format(convers_id))
+
+    def build_dispatch(self):
+        """Build handlers to apply for the `self.data` types.
+
+        Returns
+        -------
+        tuple
+            Containing the list of functions to apply to each message and
+            the `dict` of handlers to apply to each attachment, by
+            attachment type (msg_functions, attach_handlers).
+
+        """
+        msg_functions = []
+        attach_handlers = {}
+        is_all = FBDataTypes.ALL in self.data
+        if is_all or FBDataTypes.MESSAGES in self.data:
+            msg_functions.append(self.check_and_get_msg)
+        if is_all or FBDataTypes.PICTURES in self.data:
+            attach_handlers["photo"] = self.get_pic
+        if is_all or FBDataTypes.GIFS in self.data:
+            attach_handlers["animated_image"] = self.get_gif
+        if is_all or FBDataTypes.VIDEOS in self.data:
+            attach_handlers["video"] = self.get_video
+        if is_all or FBDataTypes.FILES in self.data:
+            attach_handlers["file"] = self.get_file
+        if is_all or FBDataTypes.LINKS in self.data:
+            attach_handlers["share"] = self.get_link
+            msg_functions.append(self.get_ranges)
+        if self.search_index:
+            msg_functions.append(self.index_msg)
+        return (msg_functions, attach_handlers)
 
     def parse(self, to_stdout=False, verbose=False):
         """Main loop for iterating over all the JSON conversations.
@@ -392,67 +925,270 @@ class FBParser(object):
             Print additionnal traces (one for each saved file) to stdout
             when it is True (`to_stdout` must be also True).
 
-        """
-        if FBDataTypes.ALL in self.data:
-            functions = [self.check_and_get_msg, self.check_and_get_pics,
-                         self.check_and_get_gifs, self.check_and_get_videos,
-                         self.check_and_get_files, self.check_and_get_links]
+        Notes
+        -----
+        When parsing fails (e.g. a request of `self.dumper` fails), the
+        downloads already submitted are still finished and recorded, and
+        the media store and search index are saved, before the exception
+        is raised.
 
-        else:
-            functions = []
-            if FBDataTypes.MESSAGES in self.data:
-                functions.append(self.check_and_get_msg)
-            if FBDataTypes.PICTURES in self.data:
-                functions.append(self.check_and_get_pics)
-            if FBDataTypes.GIFS in self.data:
-                functions.append(self.check_and_get_gifs)
-            if FBDataTypes.VIDEOS in self.data:
-                functions.append(self.check_and_get_videos)
-            if FBDataTypes.FILES in self.data:
-                functions.append(self.check_and_get_files)
-            if FBDataTypes.LINKS in self.data:
-                functions.append(self.check_and_get_links)
-
-        if self.infile_json:
-            for file in self.infile_json:
-                if to_stdout:
-                    print("[+] - Loading JSON from file '{}'".format(file))
-                self.init_parser_for_next(file)
-                self.process_msgs(functions)
+        """
+        self.to_stdout = to_stdout
+        self.verbose = verbose
+        msg_functions, attach_handlers = self.build_dispatch()
+        in_processes = self.infile_json and self.processes > 1
+
+        try:
+            if in_processes:
+                self.parse_in_processes(to_stdout, verbose)
+
+            elif self.infile_json:
+                for file in self.infile_json:
+                    self.parse_file(file, msg_functions, attach_handlers,
+                                    to_stdout, verbose, wait=False)
+
+            elif self.db:
+                for convers_id in self.db.get_convers_ids():
+                    self.parse_db_convers(convers_id, msg_functions,
+                                          attach_handlers, to_stdout)
+
+            elif self.dumper:
+                for convers_id in self.dumper.get_convers_ids():
+                    msgs = self.dumper.iter_convers(convers_id, to_stdout,
+                                                    save=self.save_dump)
+                    self.parse_msgs(msgs, msg_functions, attach_handlers,
+                                    to_stdout)
+
+            elif self.json_msgs:
+                self.init_convers()
+                self.process_msgs(msg_functions, attach_handlers)
                 if to_stdout:
                     print("[+]     - JSON parsed succesfully, saving results "
                           "inside folder '" + str(self.output) + "'")
                     self.print_summary_report()
-                if self.check_and_get_msg in functions:
-                    dict_c = {self.convers_id: self.convers[self.convers_id]}
-                    self.msgs = format_convers_metadata(dict_c,
-                                                        self.participants) \
-                        + "\n" + "-" * 79 + "\n\n" + self.msgs
-                self.write_reports_to_file()
-                self.wait_threads(to_stdout, verbose)
-
-        elif self.json_msgs:
-            self.process_msgs(functions)
+                self.close_reports()
+        finally:
+            try:
+                if not in_processes:
+                    self.finish_downloads(to_stdout, verbose)
+            finally:
+                if to_stdout and verbose and self.transport:
+                    print(self.transport.format_stats())
+
+                if self.store:
+                    self.store.save()
+                if self.search_index:
+                    self.search_index.close()
+                if self.downloader:
+                    self.downloader.close()
+
+    def parse_file(self, infile_json, msg_functions, attach_handlers,
+                   to_stdout=False, verbose=False, wait=True):
+        """Parse a single JSON conversation file.
+
+        Parameters
+        ----------
+        infile_json : str
+            Filepath from where to load the JSON conversation.
+        msg_functions: array_like
+            Array of functions to apply to each message.
+        attach_handlers: dict
+            Functions to apply to each attachment, by attachment type.
+        to_sdout : bool
+           Print traces to stdout when it is True. The default is False.
+        verbose: bool
+            Print additionnal traces (one for each saved file) to stdout
+            when it is True (`to_stdout` must be also True).
+        wait : bool, optional
+            Wait for the downloads of the conversation when it is True.
+            Otherwise they keep running while next files are parsed, until
+            `finish_downloads` is called. The default is True.
+
+        Returns
+        -------
+        tuple
+            Containing the cnt variable of each data types (msgs, pics,
+            gifs, videos, files and links).
+
+        """
+        self.to_stdout = to_stdout
+        self.verbose = verbose
+        if to_stdout:
+            print("[+] - Loading JSON from file '{}'".format(infile_json))
+        if not self.init_parser_for_next(infile_json):
+            if to_stdout:
+                print("[+]     - No message to parse")
+            return (0, 0, 0, 0, 0, 0)
+        try:
+            self.process_msgs(msg_functions, attach_handlers)
+        finally:
+            self.close_reports()
+        if to_stdout:
+            print("[+]     - JSON parsed succesfully, saving results "
+                  "inside folder '" + str(self.output) + "'")
+            self.print_summary_report()
+        if wait:
+            self.finish_downloads(to_stdout, verbose)
+
+        return (self.cnt_msgs, self.cnt_pics, self.cnt_gifs,
+                self.cnt_videos, self.cnt_files, self.cnt_links)
+
+    def parse_db_convers(self, convers_id, msg_functions, attach_handlers,
+                         to_stdout=False):
+        """Parse a single conversation of `self.db`.
+
+        Downloads are not waited (see `finish_downloads`).
+
+        Parameters
+        ----------
+        convers_id : str
+            Conversation ID.
+        msg_functions: array_like
+            Array of functions to apply to each message.
+        attach_handlers: dict
+            Functions to apply to each attachment, by attachment type.
+        to_sdout : bool
+           Print traces to stdout when it is True. The default is False.
+
+        Notes
+        -----
+        Without functions to apply to each message, only messages with
+        attachments of `attach_handlers` types are queried. A conversation
+        without any of them is skipped.
+
+        """
+        if to_stdout:
+            print("[+] - Loading messages of conversation '{}' from the "
+                  "database".format(convers_id))
+        msgs = self.db.iter_messages(
+            convers_id,
+            attach_types=None if msg_functions else list(attach_handlers),
+            since=self.since, until=self.until)
+        self.parse_msgs(msgs, msg_functions, attach_handlers, to_stdout)
+
+    def parse_msgs(self, msgs, msg_functions, attach_handlers,
+                   to_stdout=False):
+        """Parse the messages of a single conversation.
+
+        Downloads are not waited (see `finish_downloads`).
+
+        Parameters
+        ----------
+        msgs : iterator
+            JSON formatted Facebook messages of the conversation.
+        msg_functions: array_like
+            Array of functions to apply to each message.
+        attach_handlers: dict
+            Functions to apply to each attachment, by attachment type.
+        to_sdout : bool
+           Print traces to stdout when it is True. The default is False.
+
+        """
+        first_msg = next(msgs, None)
+        if first_msg is None:
             if to_stdout:
-                print("[+]     - JSON parsed succesfully, saving results "
-                      "inside folder '" + str(self.output) + "'")
-                self.print_summary_report()
-            self.write_reports_to_file()
-            self.wait_threads(to_stdout, verbose)
+                print("[+]     - No message to parse")
+            return
+        self.json_msgs = chain([first_msg], msgs)
+        self.init_convers(first_msg)
+        # Reports parsed so far are flushed even when `msgs` fails, e.g.
+        # on a request error of a dumper
+        try:
+            self.process_msgs(msg_functions, attach_handlers)
+        finally:
+            self.close_reports()
+        if to_stdout:
+            print("[+]     - Messages parsed succesfully, saving results "
+                  "inside folder '" + str(self.output) + "'")
+            self.print_summary_report()
+
+    def parse_in_processes(self, to_stdout=False, verbose=False):
+        """Parse `self.infile_json` files inside a pool of processes.
+
+        Each process parses whole conversations and writes their reports.
+        Counts of every conversation are gathered in a global summary report.
+
+        Parameters
+        ----------
+        to_sdout : bool
+           Print traces to stdout when it is True. The default is False.
+        verbose: bool
+            Print additionnal traces (one for each saved file) to stdout
+            when it is True (`to_stdout` must be also True).
+
+        """
+        parser_kwargs = {"user_raw_data": self.user_raw_data,
+                         "infile_json": self.infile_json,
+                         "mode": self.mode, "data": self.data,
+                         "threads": self.threads, "output": self.output,
+                         "engine": self.engine,
+                         "limit_per_host": self.limit_per_host,
+                         "store": self.store_location,
+                         "queue_size": self.queue_size,
+                         "priorities": self.priorities,
+                         "smallest_first": self.smallest_first,
+                         "max_rate": self.max_rate,
+                         "retries": self.retries,
+                         "backoff": self.backoff,
+                         "refresh_expired": self.refresh_expired,
+                         "index": self.index_location,
+                         "since": self.since, "until": self.until,
+                         "convers": self.convers,
+                         "participants": self.participants}
+        total_cnts = [0] * 6
+        nb_parsed = 0
+        with ProcessPoolExecutor(max_workers=self.processes,
+                                 initializer=_init_worker_parser,
+                                 initargs=(parser_kwargs,)) as executor:
+            parse_futures = {executor.submit(_parse_file_in_worker, file,
+                                             to_stdout, verbose): file
+                             for file in self.infile_json}
+            for future in futures.as_completed(parse_futures):
+                try:
+                    cnts = future.result()
+                except Exception as e:
+                    if to_stdout:
+                        print("[+] - File '" + parse_futures[future]
+                              + "' generated an exception: " + repr(e))
+                        continue
+                    raise e
+                total_cnts = [t + c for t, c in zip(total_cnts, cnts)]
+                nb_parsed += 1
 
-    def process_msgs(self, functions):
-        """Aply `functions` to each message in `self.json_msgs`.
+        if to_stdout:
+            print(self.global_summary_report_fmt.format(
+                nb_parsed, len(self.infile_json), *total_cnts))
+
+    def process_msgs(self, msg_functions, attach_handlers):
+        """Apply handlers to each message in `self.json_msgs`.
+
+        Each attachment is visited once and routed to its handler
+        by `attach_type`.
 
         Parameters
         ----------
-        functions: array_like
-            Array of functions to apply to `self.json_msgs`.
+        msg_functions: array_like
+            Array of functions to apply to each message.
+        attach_handlers: dict
+            Functions to apply to each attachment, by attachment type.
+
+        See Also
+        --------
+        build_dispatch : method building `msg_functions` and
+            `attach_handlers`.
 
         """
         for msg in self.json_msgs:
             if self.common_checks(msg):
-                    for function in functions:
-                        function(msg)
+                self.current_msg = msg
+                if attach_handlers:
+                    for attachment in msg["attachments"]:
+                        handler = attach_handlers.get(
+                            attachment["attach_type"])
+                        if handler is not None:
+                            handler(attachment)
+                for function in msg_functions:
+                    function(msg)
 
     def wait_threads(self, to_stdout=False, verbose=False):
         """Wait download threads to be finished.
@@ -469,33 +1205,180 @@ class FBParser(object):
         -----
         if to_stdout is False, exceptions won't be printed but threw.
 
+        Downloads of all the conversations parsed since the last call are
+        waited, a trace is printed when those of a conversation are all
+        finished.
+
+        See Also
+        --------
+        handle_download : method handling each completed download.
+
         """
         if self.mode == FBParserMode.DL:
+            self.to_stdout = to_stdout
+            self.verbose = verbose
             if to_stdout:
                 print("[+]     - Waiting for downloading threads to finished")
 
             loading_thread = PrintLoading(len(self.futures))
             loading_thread.daemon = True
-            loading_thread.start()
-            for future in futures.as_completed(self.futures):
-                try:
-                    future.result()
-                    if to_stdout and verbose:
-                        print("[+]     - File '" + self.futures[future]
-                              + "' saved")
-                except Exception as e:
-                    if to_stdout:
-                        print("[+]     - File '" + self.futures[future]
-                              + "' generated an exception: " + str(e))
-                    else:
-                        raise e
-                finally:
-                    loading_thread.cnt -= 1
+            if self.print_loading:
+                loading_thread.start()
+            try:
+                while self.futures:
+                    self.handle_download(self.completed_futures.get())
+                    loading_thread.cnt = len(self.futures)
+            finally:
+                loading_thread.run_flag = False
+                if self.print_loading:
+                    loading_thread.join()
+            for convers_id in list(self.remaining_convers):
+                self.print_downloads_finished(convers_id)
+
+    def finish_downloads(self, to_stdout=False, verbose=False):
+        """Wait for the downloads, refresh expired ones and record them.
 
-            loading_thread.run_flag = False
-            loading_thread.join()
+        Parameters
+        ----------
+        to_stdout : bool
+           Print traces to stdout when it is True. The default is False.
+        verbose: bool
+            Print additionnal traces (one for each saved file) to stdout
+            when it is True (`to_stdout` must be also True).
 
-    def dl_file(self, url, filelocation):
+        Notes
+        -----
+        Downloads still expired are saved inside an `expired.json` file
+        of their conversation folder.
+
+        """
+        if self.mode != FBParserMode.DL:
+            return
+        self.wait_threads(to_stdout, verbose)
+        if self.expired and self.refresh_expired:
+            self.refresh_expired_downloads(to_stdout, verbose)
+        for convers_id, records in self.expired.items():
+            with open(self.build_output_convers(convers_id)
+                      + self._expired_filename, 'w') as f:
+                json.dump(records, f)
+            if to_stdout:
+                print("[+]     - {} expired URLs of conversation '{}' "
+                      "recorded".format(len(records), convers_id))
+        self.expired = {}
+
+    def refresh_expired_downloads(self, to_stdout=False, verbose=False):
+        """Retry the expired downloads of `self.expired` with fresh URLs.
+
+        For each conversation, only the pages of messages containing the
+        expired attachments are requested from Facebook, from the newest
+        to the oldest, using their timestamps as cursor.
+
+        Parameters
+        ----------
+        to_stdout : bool
+           Print traces to stdout when it is True. The default is False.
+        verbose: bool
+            Print additionnal traces (one for each saved file) to stdout
+            when it is True (`to_stdout` must be also True).
+
+        """
+        if self.user_raw_data is None:
+            if to_stdout:
+                print("[+]     - Expired URLs can not be refreshed without "
+                      "--cookie")
+            return
+        fb_dumper = self.dumper or FBDumper("", self.user_raw_data,
+                                            output=self.output,
+                                            transport=self.transport,
+                                            cache_ttl=float("inf"))
+        expired = self.expired
+        self.expired = {}
+        for convers_id, records in expired.items():
+            if to_stdout:
+                print("[+]     - Refreshing {} expired URLs of conversation "
+                      "'{}'".format(len(records), convers_id))
+            self.convers_id = convers_id
+            self.output_convers = self.build_output_convers(convers_id)
+            pending = {(r["message_id"], r["name"]): r for r in records}
+            while pending:
+                timestamp = max(r["timestamp"] for r in pending.values())
+                msgs = fb_dumper.get_messages_before(convers_id,
+                                                     timestamp + 1)
+                if not msgs:
+                    break
+                for msg in msgs:
+                    for attachment in msg["attachments"]:
+                        record = pending.pop((msg["message_id"],
+                                              attachment.get("name")), None)
+                        if record is None:
+                            continue
+                        data_type = FBDataTypes(record["data_type"])
+                        self.current_msg = msg
+                        self.submit_download(
+                            attachment[self._dl_url_keys[data_type]],
+                            data_type, record["name"], record["filename"])
+                oldest_timestamp = msgs[0]["timestamp"]
+                pending = {k: r for k, r in pending.items()
+                           if r["timestamp"] < oldest_timestamp}
+        self.wait_threads(to_stdout, verbose)
+
+    def build_output_convers(self, convers_id):
+        """Build the output folder of a conversation.
+
+        Parameters
+        ----------
+        convers_id : str
+            Conversation ID.
+
+        Returns
+        -------
+        str
+            Return the folder path, ending with a separator.
+
+        """
+        return os.path.join(self.output, convers_id + " - "
+                            + unidecode(self.convers[convers_id]["name"]),
+                            '')
+
+    def dl_next_file(self):
+        """Download the file of highest priority function.
+
+        One call is submitted to `self.executor` for each download. The
+        job is only taken from `self.download_jobs` once a thread is free,
+        so it is the job of highest priority at that time.
+
+        Notes
+        -----
+        With `self.smallest_first`, a job whose size is unknown (-1) is
+        probed with a HEAD request and put back inside the queue.
+
+        Failed downloads are retried by `self.transport`, interrupted ones
+        resume from their partly downloaded file.
+
+        """
+        job = self.download_jobs.get_nowait()
+        (priority, size), _, future, url, filelocation, on_complete = job
+        if size < 0:
+            try:
+                size = int(self.transport.head(url)
+                           .headers["Content-Length"])
+            except (KeyError, ValueError, RequestException):
+                size = float("inf")
+            self.download_jobs.put(((priority, size),) + job[1:])
+            self.executor.submit(self.dl_next_file)
+            return
+
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            self.transport.call(partial(self.dl_file, url, filelocation,
+                                        on_complete))
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            future.set_result(None)
+
+    def dl_file(self, url, filelocation, on_complete=None):
         """Download file function.
 
         Parameters
@@ -504,18 +1387,101 @@ class FBParser(object):
            URL where to download the file.
         filelocation : str
             Path where to save file.
+        on_complete : callable, optional
+            Function called without arguments once the file is saved.
+
+        Notes
+        -----
+        The file is downloaded to `filelocation` + `PART_EXTENSION` and
+        renamed once complete. An existing partly downloaded file is
+        resumed using a `Range` request. If `filelocation` already exists,
+        nothing is downloaded.
+
+        Bodies are requested without `Content-Encoding`, as ranges would
+        apply to the encoded bytes. Bodies encoded anyway are never
+        resumed, and their size is not checked against the encoded
+        `Content-Length`.
 
         """
-        r = requests.get(url, stream=True)
-        with open(filelocation, 'wb') as f:
+        if not os.path.isfile(filelocation):
+            part_filelocation = filelocation + PART_EXTENSION
+            offset = get_part_size(part_filelocation)
+            headers = {"Accept-Encoding": "identity"}
+            if offset:
+                headers["Range"] = "bytes={}-".format(offset)
+
+            # Closing the response gives its connection back to the pool,
+            # even when the download fails
+            with self.transport.get(url, stream=True, headers=headers) as r:
+                is_encoded = r.headers.get("Content-Encoding",
+                                           "identity") != "identity"
+                try:
+                    write_mode = get_part_write_mode(
+                        offset, r.status_code, r.headers.get("Content-Range"))
+                    if is_encoded and write_mode == 'ab':
+                        raise FBTransferError("Encoded body can not be "
+                                              "resumed")
+                except FBTransferError:
+                    if offset:
+                        os.remove(part_filelocation)
+                    raise
+                if write_mode is not None:
+                    r.raise_for_status()
+                    size = self.write_response(r, part_filelocation,
+                                               write_mode)
+                    if self.quit:
+                        return
+                    # A connection closed early may end the body silently
+                    content_length = r.headers.get("Content-Length")
+                    if not is_encoded and content_length is not None \
+                            and size != int(content_length):
+                        raise FBTransferError("Truncated body: {}/{} bytes "
+                                              "received".format(
+                                                  size, content_length))
+            os.replace(part_filelocation, filelocation)
+        if on_complete is not None:
+            on_complete()
+
+    def write_response(self, r, filelocation, write_mode):
+        """Write the body of a streamed response to a file.
+
+        Parameters
+        ----------
+        r : requests.Response
+            Streamed response.
+        filelocation : str
+            Path where to save the body.
+        write_mode : str
+            Mode used for opening the file, 'wb' or 'ab'.
+
+        Returns
+        -------
+        int
+            Return the number of bytes written.
+
+        Notes
+        -----
+        Writing stops early when `self.quit` is True.
+
+        """
+        size = 0
+        with open(filelocation, write_mode) as f:
             for chunk in r.iter_content(chunk_size=1024):
                 if self.quit:
-                    break
+                    return size
                 if chunk:
+                    if self.rate_limiter:
+                        self.rate_limiter.acquire(len(chunk))
                     f.write(chunk)
+                    size += len(chunk)
+        return size
+
+    def open_reports(self):
+        """Open all reports inside the `self.output_convers` location.
 
-    def write_reports_to_file(self):
-        """Write all reports inside the `self.output_convers` location.
+        Reports are written incrementally while parsing through buffered
+        writers, so their memory usage does not depend on the size of the
+        conversation.
 
         See Also
         --------
@@ -524,29 +1490,56 @@ class FBParser(object):
         Notes
         -----
         Reports are `msgs`, `pics`, `gifs`, `videos`,
-        `files`, `links` content inside a `FBParser` instance.
+        `files`, `links` file objects inside a `FBParser` instance.
 
         Report file names are `FBDataTypes` values with ".txt" appended.
 
+        When messages are retrieved, the messages report starts with the
+        conversation metadata.
+
+        """
+        self.msgs = self.open_report(FBDataTypes.MESSAGES)
+        self.pics = self.open_report(FBDataTypes.PICTURES)
+        self.gifs = self.open_report(FBDataTypes.GIFS)
+        self.videos = self.open_report(FBDataTypes.VIDEOS)
+        self.files = self.open_report(FBDataTypes.FILES)
+        self.links = self.open_report(FBDataTypes.LINKS)
+
+        if (FBDataTypes.ALL in self.data
+                or FBDataTypes.MESSAGES in self.data):
+            dict_c = {self.convers_id: self.convers[self.convers_id]}
+            self.msgs.write(format_convers_metadata(dict_c,
+                                                    self.participants)
+                            + "\n" + "-" * 79 + "\n\n")
+
+    def open_report(self, data_type):
+        """Open the report of `data_type` for writing.
+
+        Parameters
+        ----------
+        data_type : FBDataTypes
+            Data type of the report.
+
+        Returns
+        -------
+        file object
+            Return the buffered text file object.
+
         """
-        with open(self.output_convers + FBDataTypes.MESSAGES.value + '.txt',
-                  'w') as f:
-            f.write(self.msgs)
-        with open(self.output_convers + FBDataTypes.PICTURES.value + '.txt',
-                  'w') as f:
-            f.write(self.pics)
-        with open(self.output_convers + FBDataTypes.GIFS.value + '.txt',
-                  'w') as f:
-            f.write(self.gifs)
-        with open(self.output_convers + FBDataTypes.VIDEOS.value + '.txt',
-                  'w') as f:
-            f.write(self.videos)
-        with open(self.output_convers + FBDataTypes.FILES.value + '.txt',
-                  'w') as f:
-            f.write(self.files)
-        with open(self.output_convers + FBDataTypes.LINKS.value + '.txt',
-                  'w') as f:
-            f.write(self.links)
+        return open(self.output_convers + data_type.value + '.txt', 'w',
+                    buffering=self._report_buffer_size)
+
+    def close_reports(self):
+        """Flush and close all reports opened by `open_reports`.
+
+        Messages buffered by the search index are written too.
+
+        """
+        for report in [self.msgs, self.pics, self.gifs, self.videos,
+                       self.files, self.links]:
+            report.close()
+        if self.search_index:
+            self.search_index.flush()
 
     def print_summary_report(self):
         """Print to stdout a summary report.
@@ -561,3 +1554,25 @@ class FBParser(object):
                                              self.cnt_files,
                                              self.cnt_links
                                              ))
+
+
+_worker_parser = None
+
+
+def _init_worker_parser(parser_kwargs):
+    """Init the `FBParser` used by a process of `parse_in_processes`."""
+    global _worker_parser
+    _worker_parser = FBParser(**parser_kwargs)
+    _worker_parser.print_loading = False
+    if _worker_parser.store:
+        _worker_parser.store.incoming_suffix = "." + str(os.getpid())
+
+
+def _parse_file_in_worker(infile_json, to_stdout, verbose):
+    """Parse a file inside a process of `parse_in_processes`."""
+    msg_functions, attach_handlers = _worker_parser.build_dispatch()
+    cnts = _worker_parser.parse_file(infile_json, msg_functions,
+                                     attach_handlers, to_stdout, verbose)
+    if _worker_parser.store:
+        _worker_parser.store.save()
+    return cnts
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""search module.
+
+This module contains a full-text search index of messages, saved inside a
+SQLite database. It is an inverted index: for each term, the messages
+containing it and the positions of the term inside them, so term, phrase
+and date-range queries do not read any message which does not match.
+
+Examples
+--------
+>>> from fbscraper.search import FBSearchIndex
+>>> index = FBSearchIndex("output/search.db")
+>>> index.add_message("1234", msg, "Alice")
+>>> index.flush()
+>>> for result in index.search('"happy birthday" cake'):
+...     print(result["body"])
+>>> index.close()
+
+"""
+import re
+import sqlite3
+
+from unidecode import unidecode
+
+
+class FBSearchIndex(object):
+    """Full-text search index of messages.
+
+    Parameters
+    ----------
+    filepath : str
+        Path of the SQLite database of the index. It is created if it does
+        not exist.
+    batch_size : int, optional
+        Number of messages added before `flush` is called automatically.
+        The default is 1000.
+
+    Raises
+    ------
+    ValueError
+        When the `batch_size` is inferior or equal to 0.
+
+    Notes
+    -----
+    Bodies are tokenized into lowercase words after being transliterated
+    to ASCII with `unidecode`, so "Café" is found by "cafe".
+
+    A message already indexed (same `message_id`) is not indexed again, so
+    the index may be built incrementally by parsing conversations several
+    times. Several processes may add messages to the same index.
+
+    Postings of a term are sorted by timestamp (and by conversation in a
+    second index), so a query only reads the postings of its time range,
+    from the newest, and stops once `limit` messages are found.
+
+    """
+
+    _schema = """
+        CREATE TABLE IF NOT EXISTS docs (
+            doc_id INTEGER PRIMARY KEY,
+            message_id TEXT UNIQUE NOT NULL,
+            convers_id TEXT NOT NULL,
+            timestamp INTEGER NOT NULL,
+            author TEXT,
+            body TEXT
+        );
+        CREATE TABLE IF NOT EXISTS terms (
+            term_id INTEGER PRIMARY KEY,
+            term TEXT UNIQUE NOT NULL,
+            doc_count INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS postings (
+            term_id INTEGER NOT NULL,
+            timestamp INTEGER NOT NULL,
+            doc_id INTEGER NOT NULL,
+            convers_id TEXT NOT NULL,
+            positions TEXT NOT NULL,
+            PRIMARY KEY (term_id, timestamp, doc_id)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS postings_convers
+            ON postings (term_id, convers_id, timestamp);
+    """
+    _regex_token = re.compile(r"\w+")
+    _regex_query = re.compile(r'"([^"]*)"|(\S+)')
+
+    def __init__(self, filepath, batch_size=1000):
+        """__init__ method."""
+        if batch_size <= 0:
+            raise ValueError('Batch size must be superior to 0. '
+                             'Value : {}'.format(batch_size))
+        self.filepath = filepath
+        self.batch_size = batch_size
+        self.connection = sqlite3.connect(filepath, timeout=60,
+                                          isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(self._schema)
+        self.term_ids = {}
+        self.pending = []
+
+    @classmethod
+    def tokenize(cls, text):
+        """Split a text into normalized terms.
+
+        Parameters
+        ----------
+        text : str
+            Text to split.
+
+        Returns
+        -------
+        list
+            Return the lowercase ASCII terms of the text, in order.
+
+        """
+        return cls._regex_token.findall(unidecode(text).lower())
+
+    def add_message(self, convers_id, msg, author=None):
+        """Add a message to the index.
+
+        Messages are buffered and written by batches (see `flush`).
+
+        Parameters
+        ----------
+        convers_id : str
+            Conversation ID of the message.
+        msg : dict
+            JSON formatted Facebook message. Messages without body are
+            ignored.
+        author : str, optional
+            Name of the author, saved with the message.
+
+        """
+        if not msg.get("body"):
+            return
+        self.pending.append((msg["message_id"], convers_id, msg["timestamp"],
+                             author, msg["body"]))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered messages and their postings."""
+        if not self.pending:
+            return
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            doc_counts = {}
+            for doc in self.pending:
+                cursor.execute("INSERT OR IGNORE INTO docs (message_id, "
+                               "convers_id, timestamp, author, body) "
+                               "VALUES (?, ?, ?, ?, ?)", doc)
+                if cursor.rowcount != 1:
+                    continue
+                doc_id = cursor.lastrowid
+                positions = {}
+                for position, term in enumerate(self.tokenize(doc[4])):
+                    positions.setdefault(term, []).append(str(position))
+                postings = [(self.get_term_id(cursor, term), doc[2], doc_id,
+                             doc[1], " ".join(term_positions))
+                            for term, term_positions in positions.items()]
+                cursor.executemany("INSERT INTO postings VALUES "
+                                   "(?, ?, ?, ?, ?)", postings)
+                for posting in postings:
+                    doc_counts[posting[0]] = doc_counts.get(posting[0],
+                                                            0) + 1
+            cursor.executemany("UPDATE terms SET doc_count = doc_count + ? "
+                               "WHERE term_id = ?",
+                               [(n, term_id)
+                                for term_id, n in doc_counts.items()])
+            cursor.execute("COMMIT")
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            # Term IDs inserted by the transaction are not valid anymore
+            self.term_ids = {}
+            raise
+        self.pending = []
+
+    def get_term_id(self, cursor, term):
+        """Get the ID of a term, inserting it if it is a new one."""
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            cursor.execute("INSERT OR IGNORE INTO terms (term) VALUES (?)",
+                           (term,))
+            if cursor.rowcount == 1:
+                term_id = cursor.lastrowid
+            else:
+                term_id = cursor.execute(
+                    "SELECT term_id FROM terms WHERE term = ?",
+                    (term,)).fetchone()[0]
+            self.term_ids[term] = term_id
+        return term_id
+
+    def search(self, query, since=None, until=None, convers_id=None,
+               limit=50):
+        """Search messages matching a query.
+
+        Parameters
+        ----------
+        query : str
+            Terms and "quoted phrases" which must all be found inside the
+            messages.
+        since : int, optional
+            Only the messages sent from this timestamp (in ms) are
+            returned.
+        until : int, optional
+            Only the messages sent before this timestamp (in ms) are
+            returned.
+        convers_id : str, optional
+            Only the messages of this conversation are returned.
+        limit : int, optional
+            Maximum number of messages returned. The default is 50.
+
+        Returns
+        -------
+        list
+            Return the matching messages as `dict` (message_id,
+            convers_id, timestamp, author and body), from the newest to
+            the oldest.
+
+        Notes
+        -----
+        Postings of the rarest term are read from the newest, and each
+        other term is looked up by the primary key of its posting for the
+        same message.
+
+        """
+        phrases = []
+        for phrase, term in self._regex_query.findall(query):
+            tokens = self.tokenize(phrase or term)
+            if tokens:
+                phrases.append(tokens)
+        terms = set(t for tokens in phrases for t in tokens)
+        if not terms:
+            return []
+
+        term_ids = {}
+        doc_counts = {}
+        for term in terms:
+            row = self.connection.execute(
+                "SELECT term_id, doc_count FROM terms WHERE term = ?",
+                (term,)).fetchone()
+            if row is None:
+                return []
+            term_ids[term] = row[0]
+            doc_counts[row[0]] = row[1]
+        ordered_ids = sorted(doc_counts, key=doc_counts.get)
+
+        sql = "SELECT p.doc_id, p.timestamp FROM postings p WHERE " \
+              "p.term_id = ?"
+        params = [ordered_ids[0]]
+        if since is not None:
+            sql += " AND p.timestamp >= ?"
+            params.append(since)
+        if until is not None:
+            sql += " AND p.timestamp < ?"
+            params.append(until)
+        if convers_id is not None:
+            sql += " AND p.convers_id = ?"
+            params.append(convers_id)
+        for term_id in ordered_ids[1:]:
+            sql += (" AND EXISTS (SELECT 1 FROM postings WHERE term_id = ? "
+                    "AND timestamp = p.timestamp AND doc_id = p.doc_id)")
+            params.append(term_id)
+        sql += " ORDER BY p.timestamp DESC, p.doc_id DESC"
+
+        multi_terms = [tokens for tokens in phrases if len(tokens) > 1]
+        results = []
+        for doc_id, timestamp in self.connection.execute(sql, params):
+            if multi_terms and not all(
+                    self.contains_phrase(doc_id, timestamp,
+                                         [term_ids[t] for t in p])
+                    for p in multi_terms):
+                continue
+            row = self.connection.execute(
+                "SELECT message_id, convers_id, timestamp, author, body "
+                "FROM docs WHERE doc_id = ?", (doc_id,)).fetchone()
+            results.append({"message_id": row[0], "convers_id": row[1],
+                            "timestamp": row[2], "author": row[3],
+                            "body": row[4]})
+            if len(results) >= limit:
+                break
+        return results
+
+    def contains_phrase(self, doc_id, timestamp, phrase_term_ids):
+        """Check whether terms follow each other inside a message.
+
+        Parameters
+        ----------
+        doc_id : int
+            ID of the message inside the index.
+        timestamp : int
+            Timestamp of the message.
+        phrase_term_ids : list
+            IDs of the terms of the phrase, in order.
+
+        Returns
+        -------
+        bool
+            Return True if the message contains the phrase.
+
+        """
+        starts = None
+        for offset, term_id in enumerate(phrase_term_ids):
+            positions = self.connection.execute(
+                "SELECT positions FROM postings WHERE term_id = ? AND "
+                "timestamp = ? AND doc_id = ?",
+                (term_id, timestamp, doc_id)).fetchone()[0]
+            term_starts = set(int(p) - offset for p in positions.split())
+            starts = term_starts if starts is None else starts & term_starts
+            if not starts:
+                return False
+        return True
+
+    def close(self):
+        """Flush the buffered messages and close the index."""
+        self.flush()
+        self.connection.close()
@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""store module.
+
+This module contains a content-addressed media store. Downloaded files are
+saved once as blobs named by the SHA-256 of their content, and the files of
+each conversation folder are hardlinks (or symlinks) to these blobs. A same
+picture forwarded inside many conversations is then downloaded and saved
+only once.
+
+Examples
+--------
+>>> from fbscraper.store import FBMediaStore
+>>> store = FBMediaStore("output/store")
+>>> if store.reserve(url, "output/111 - Alice/pictures/photo.jpg"):
+...     dl_file(url, store.build_incoming_path(url))
+...     store.add(url, store.build_incoming_path(url))
+>>> store.save()
+
+"""
+import hashlib
+import json
+import os
+from threading import Lock
+from urllib import parse
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class FBMediaStore(object):
+    """Content-addressed media store.
+
+    Parameters
+    ----------
+    location : str
+        Folder of the store. It is created if it does not exist.
+
+    Attributes
+    ----------
+    incoming_suffix : str
+        Suffix of the files being downloaded inside the store. Processes
+        sharing a store must use different suffixes.
+
+    Notes
+    -----
+    Blobs are saved as `<location>/<2 first hash chars>/<hash>`.
+
+    The index, saved as `<location>/index.json`, maps the URLs of known
+    attachments to the hash of their content. Signature parameters are not
+    part of the keys, as Facebook CDN URLs carry signatures changing at each
+    dump (see `build_key`).
+
+    A `FBMediaStore` instance may be shared between threads.
+
+    """
+
+    _index_filename = "index.json"
+    _lock_filename = "index.lock"
+    _signature_params = ("oh", "oe", "efg", "ccb")
+    _signature_params_prefix = "_nc_"
+    _incoming_folder = "incoming"
+    _hash_chunk_size = 1024 * 1024
+
+    def __init__(self, location):
+        """__init__ method."""
+        self.location = os.path.join(location, '')
+        os.makedirs(self.location + self._incoming_folder, exist_ok=True)
+        self.incoming_suffix = ""
+        self.index = self.read_index()
+        self.pending = {}
+        self.downloading = set()
+        self.lock = Lock()
+
+    @staticmethod
+    def build_key(url):
+        """Build the index key of an URL, i.e. the URL without signature.
+
+        Parameters
+        ----------
+        url : str
+            URL of an attachment.
+
+        Returns
+        -------
+        str
+            Return the index key. Signature parameters of the query ('oh',
+            'oe', '_nc_*'...) are removed, other ones are kept sorted, as
+            some URLs identify their file by query (e.g.
+            'photo.php?fbid=').
+
+        """
+        url_parsed = parse.urlsplit(url)
+        params = sorted(
+            (name, value) for name, value
+            in parse.parse_qsl(url_parsed.query, keep_blank_values=True)
+            if name not in FBMediaStore._signature_params
+            and not name.startswith(FBMediaStore._signature_params_prefix))
+        key = url_parsed.netloc + url_parsed.path
+        if params:
+            key += "?" + parse.urlencode(params)
+        return key
+
+    def build_blob_path(self, digest):
+        """Build the path of the blob of a hash.
+
+        Parameters
+        ----------
+        digest : str
+            SHA-256 hexadecimal digest of the blob.
+
+        Returns
+        -------
+        str
+            Return the path of the blob.
+
+        """
+        return self.location + digest[:2] + os.sep + digest
+
+    def build_incoming_path(self, url):
+        """Build the path where to download an URL before adding it.
+
+        Parameters
+        ----------
+        url : str
+            URL of an attachment.
+
+        Returns
+        -------
+        str
+            Return the path of the file to download. It only depends on the
+            URL key, so interrupted downloads may be resumed.
+
+        """
+        key_digest = hashlib.sha1(self.build_key(url).encode()).hexdigest()
+        return (self.location + self._incoming_folder + os.sep + key_digest
+                + self.incoming_suffix)
+
+    def reserve(self, url, filelocation):
+        """Reserve the download of an URL for the `filelocation` file.
+
+        If the URL is already inside the store, `filelocation` is linked to
+        its blob at once. If it is being downloaded, `filelocation` will be
+        linked by `add`. If its download failed (see `release`), the caller
+        downloads it again.
+
+        Parameters
+        ----------
+        url : str
+            URL of an attachment.
+        filelocation : str
+            Path where to link the attachment.
+
+        Returns
+        -------
+        bool
+            Return True if the caller must download the URL to
+            `build_incoming_path` then call `add`, False otherwise.
+
+        """
+        key = self.build_key(url)
+        with self.lock:
+            digest = self.index.get(key)
+            if digest is None or not os.path.isfile(
+                    self.build_blob_path(digest)):
+                self.pending.setdefault(key, []).append(filelocation)
+                if key in self.downloading:
+                    return False
+                self.downloading.add(key)
+                return True
+        self.link(self.build_blob_path(digest), filelocation)
+        return False
+
+    def add(self, url, incoming_filelocation):
+        """Add a downloaded file to the store.
+
+        The file is moved as a blob (or removed if the blob already exists)
+        and linked to every file location reserved for the URL.
+
+        Parameters
+        ----------
+        url : str
+            URL of the attachment.
+        incoming_filelocation : str
+            Path of the downloaded file.
+
+        Returns
+        -------
+        str
+            Return the path of the blob.
+
+        """
+        digest = self.hash_file(incoming_filelocation)
+        blob_filelocation = self.build_blob_path(digest)
+        key = self.build_key(url)
+        os.makedirs(os.path.dirname(blob_filelocation), exist_ok=True)
+        with self.lock:
+            try:
+                # Never replace an existing blob, another process may
+                # already have linked it.
+                os.link(incoming_filelocation, blob_filelocation)
+                os.remove(incoming_filelocation)
+            except FileExistsError:
+                os.remove(incoming_filelocation)
+            except OSError:
+                os.replace(incoming_filelocation, blob_filelocation)
+            self.index[key] = digest
+            self.downloading.discard(key)
+            filelocations = self.pending.pop(key, [])
+        for filelocation in filelocations:
+            self.link(blob_filelocation, filelocation)
+        return blob_filelocation
+
+    def release(self, url):
+        """Release the reservation of an URL whose download failed.
+
+        File locations waiting for the URL stay reserved: the next
+        `reserve` of the URL (e.g. with a refreshed URL) returns True, and
+        they are all linked once it is downloaded and added.
+
+        Parameters
+        ----------
+        url : str
+            URL of the attachment.
+
+        """
+        with self.lock:
+            self.downloading.discard(self.build_key(url))
+
+    def link(self, blob_filelocation, filelocation):
+        """Link `filelocation` to a blob.
+
+        A hardlink is created, or a symlink if hardlinks are not supported
+        (e.g. the store is on another filesystem).
+
+        Parameters
+        ----------
+        blob_filelocation : str
+            Path of the blob.
+        filelocation : str
+            Path where to link the blob.
+
+        Returns
+        -------
+        str
+            Return the path of the link. When `filelocation` already exists
+            with a different content, " (1)", " (2)"... is appended to the
+            filename instead of overwriting it.
+
+        Notes
+        -----
+        An existing file with the same content as the blob (e.g. downloaded
+        before using the store) is replaced by a link.
+
+        """
+        root, ext = os.path.splitext(filelocation)
+        candidate = filelocation
+        cnt = 0
+        while True:
+            if os.path.lexists(candidate):
+                if self.is_same_content(blob_filelocation, candidate):
+                    if not os.path.samefile(blob_filelocation, candidate):
+                        tmp_filelocation = candidate + ".tmp"
+                        self.create_link(blob_filelocation, tmp_filelocation)
+                        os.replace(tmp_filelocation, candidate)
+                    return candidate
+            else:
+                try:
+                    self.create_link(blob_filelocation, candidate)
+                    return candidate
+                except FileExistsError:
+                    continue
+            cnt += 1
+            candidate = "{} ({}){}".format(root, cnt, ext)
+
+    @staticmethod
+    def create_link(blob_filelocation, filelocation):
+        """Create a hardlink, or a relative symlink, to a blob."""
+        try:
+            os.link(blob_filelocation, filelocation)
+        except FileExistsError:
+            raise
+        except OSError:
+            os.symlink(os.path.relpath(blob_filelocation,
+                                       os.path.dirname(filelocation)),
+                       filelocation)
+
+    def is_same_content(self, blob_filelocation, filelocation):
+        """Check whether a file has the same content as a blob.
+
+        Parameters
+        ----------
+        blob_filelocation : str
+            Path of the blob.
+        filelocation : str
+            Path of the file.
+
+        Returns
+        -------
+        bool
+            Return True if the file is a link to the blob or has the same
+            content, False otherwise.
+
+        """
+        if not os.path.exists(filelocation):
+            return False
+        if os.path.samefile(blob_filelocation, filelocation):
+            return True
+        if os.path.getsize(blob_filelocation) != os.path.getsize(
+                filelocation):
+            return False
+        return (self.hash_file(filelocation)
+                == os.path.basename(blob_filelocation))
+
+    def hash_file(self, filelocation):
+        """Compute the SHA-256 hexadecimal digest of a file."""
+        sha256 = hashlib.sha256()
+        with open(filelocation, 'rb') as f:
+            for chunk in iter(lambda: f.read(self._hash_chunk_size), b''):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def read_index(self):
+        """Read the index of the store.
+
+        Returns
+        -------
+        dict
+            Return the URL keys mapped to their hash, empty if there is no
+            index yet.
+
+        """
+        try:
+            with open(self.location + self._index_filename, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def save(self):
+        """Save the index of the store.
+
+        The index is merged with the one saved on disk, so several
+        processes may share a store. The merge is done while holding a lock
+        file (where `fcntl` is available), so concurrent saves never lose
+        each other's entries.
+
+        """
+        with self.lock, open(self.location + self._lock_filename,
+                             'w') as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            index = self.read_index()
+            index.update(self.index)
+            self.index = index
+            filepath = self.location + self._index_filename
+            tmp_filepath = filepath + ".tmp" + self.incoming_suffix
+            with open(tmp_filepath, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp_filepath, filepath)
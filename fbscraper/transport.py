@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""transport module.
+
+This module contains the HTTP transport layer shared by the dumper and the
+parser. Every request goes through a pooled keep-alive `requests.Session`,
+so TCP and TLS handshakes are only paid once per connection.
+
+Examples
+--------
+>>> from fbscraper.transport import FBTransport
+>>> transport = FBTransport(pool_size=8)
+>>> r = transport.get("https://www.facebook.com", stream=True)
+>>> print(transport.format_stats())
+
+"""
+import json
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ChunkedEncodingError, ConnectionError, \
+                                HTTPError, Timeout
+
+from fbscraper.lib import RETRY_STATUS_CODES, CircuitBreaker, \
+                          FBTransferError, get_retry_delay
+
+
+class FBTransport(object):
+    """Pooled keep-alive HTTP transport.
+
+    Parameters
+    ----------
+    pool_size : int, optional
+        Maximum number of connections kept alive for each host. It should
+        match the number of threads using the transport. The default is 4.
+    host_pools : int, optional
+        Maximum number of per-host pools kept alive. Downloads spread over
+        many CDN hosts, so it is independent from `pool_size`. The default
+        is 32.
+    retries : int, optional
+        Number of retries of a failed `request` or `call`. The default
+        is 3.
+    backoff : float, optional
+        Base delay in seconds of the exponential backoff between retries
+        (see `get_retry_delay`). The default is 1.
+    circuit_breaker : CircuitBreaker, optional
+        Circuit breaker pausing every caller when requests keep failing.
+        If None, a new one is created.
+
+    Raises
+    ------
+    ValueError
+        When the `pool_size` or the number of `host_pools` is inferior or
+        equal to 0.
+
+        When the number of `retries` or the `backoff` is inferior to 0.
+
+    Notes
+    -----
+    A `FBTransport` instance may be shared between threads, connections are
+    handed out by the underlying `urllib3` pools.
+
+    Connection errors, timeouts, truncated bodies, JSON bodies which can
+    not be decoded, `FBTransferError` and `RETRY_STATUS_CODES` responses
+    are retried, honoring the 'Retry-After' header. Other errors (e.g. an
+    invalid URL) are raised at once, without being recorded by the circuit
+    breaker.
+
+    Requests have no total timeout, they are only aborted when connecting
+    or waiting for data takes too long, like `FBAsyncDownloader` does. A
+    `timeout` keyword argument overrides it for a single request.
+
+    """
+
+    _connect_timeout = 30
+    _read_timeout = 120
+
+    stats_fmt = "[+]     - Connections : {} requests, {} connections " \
+                "opened, {} reused"
+
+    def __init__(self, pool_size=4, host_pools=32, retries=3, backoff=1,
+                 circuit_breaker=None):
+        """__init__ method."""
+        if pool_size <= 0 or host_pools <= 0:
+            raise ValueError('Pool size and host pools must be superior to '
+                             '0. Pool size : {} - Host pools : {}'
+                             .format(pool_size, host_pools))
+        if retries < 0 or backoff < 0:
+            raise ValueError('Retries and backoff must be positive. '
+                             'Retries : {} - Backoff : {}'
+                             .format(retries, backoff))
+        self.pool_size = pool_size
+        self.host_pools = host_pools
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = (self._connect_timeout, self._read_timeout)
+        self.circuit_breaker = circuit_breaker if circuit_breaker \
+            else CircuitBreaker()
+
+        # Counters of the pools evicted or closed, so stats are cumulative
+        self.lock = threading.Lock()
+        self.closed_requests = 0
+        self.closed_connections = 0
+
+        self.adapter = HTTPAdapter(pool_connections=host_pools,
+                                   pool_maxsize=pool_size,
+                                   pool_block=True)
+        self.adapter.poolmanager.pools.dispose_func = self.dispose_pool
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+
+    def post(self, url, **kwargs):
+        """Make a POST request using the pooled session.
+
+        Parameters
+        ----------
+        url : str
+            URL where making the request.
+        **kwargs
+            Passed to `requests.Session.post`.
+
+        Returns
+        -------
+        requests.Response
+            The response of the request.
+
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.post(url, **kwargs)
+
+    def get(self, url, **kwargs):
+        """Make a GET request using the pooled session.
+
+        Parameters
+        ----------
+        url : str
+            URL where making the request.
+        **kwargs
+            Passed to `requests.Session.get`.
+
+        Returns
+        -------
+        requests.Response
+            The response of the request.
+
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.get(url, **kwargs)
+
+    def head(self, url, **kwargs):
+        """Make a HEAD request using the pooled session.
+
+        Parameters
+        ----------
+        url : str
+            URL where making the request.
+        **kwargs
+            Passed to `requests.Session.head`.
+
+        Returns
+        -------
+        requests.Response
+            The response of the request. Redirections are followed.
+
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.head(url, allow_redirects=True, **kwargs)
+
+    def request(self, method, url, parse=None, **kwargs):
+        """Make a request using the pooled session, with retries.
+
+        Parameters
+        ----------
+        method : str
+            HTTP method of the request.
+        url : str
+            URL where making the request.
+        parse : callable, optional
+            Function applied to the response, inside the retried attempt.
+            A `json.JSONDecodeError` or `FBTransferError` it raises (e.g.
+            for a truncated JSON body) makes the request retried.
+        **kwargs
+            Passed to `requests.Session.request`.
+
+        Returns
+        -------
+        requests.Response
+            The response of the request, or the value returned by `parse`.
+
+        Raises
+        ------
+        requests.exceptions.HTTPError
+            When the response status is one of `RETRY_STATUS_CODES` once
+            retries are exhausted.
+
+        """
+        kwargs.setdefault("timeout", self.timeout)
+
+        def send():
+            r = self.session.request(method, url, **kwargs)
+            if r.status_code in RETRY_STATUS_CODES:
+                r.raise_for_status()
+            return parse(r) if parse else r
+
+        return self.call(send)
+
+    def call(self, send):
+        """Call `send` until it succeeds or retries are exhausted.
+
+        Parameters
+        ----------
+        send : callable
+            Function without arguments making a request, e.g. a whole
+            download. It is retried when it raises a retryable error.
+
+        Returns
+        -------
+        object
+            Return the value returned by `send`.
+
+        Notes
+        -----
+        Every attempt first waits for the circuit breaker to be closed,
+        and records its outcome inside it.
+
+        """
+        attempt = 0
+        while True:
+            self.circuit_breaker.wait()
+            try:
+                result = send()
+            except HTTPError as e:
+                if (e.response is None or e.response.status_code
+                        not in RETRY_STATUS_CODES):
+                    raise e
+                self.circuit_breaker.record_failure()
+                if attempt >= self.retries:
+                    raise e
+                retry_after = e.response.headers.get("Retry-After")
+            except (ConnectionError, Timeout, ChunkedEncodingError,
+                    json.JSONDecodeError, FBTransferError) as e:
+                self.circuit_breaker.record_failure()
+                if attempt >= self.retries:
+                    raise e
+                retry_after = None
+            else:
+                self.circuit_breaker.record_success()
+                return result
+            time.sleep(get_retry_delay(attempt, self.backoff, retry_after))
+            attempt += 1
+
+    def dispose_pool(self, pool):
+        """Record the counters of an evicted host pool, then close it.
+
+        Parameters
+        ----------
+        pool : urllib3.connectionpool.HTTPConnectionPool
+            Pool evicted from the pool manager.
+
+        """
+        with self.lock:
+            self.closed_requests += pool.num_requests
+            self.closed_connections += pool.num_connections
+        pool.close()
+
+    def stats(self):
+        """Get connection reuse statistics.
+
+        Returns
+        -------
+        dict
+            Containing the number of `requests` made, the number of
+            `connections` opened and the number of requests which `reused`
+            an already opened connection. Pools evicted or closed are
+            counted too.
+
+        """
+        pools = self.adapter.poolmanager.pools
+        with pools.lock, self.lock:
+            nb_requests = self.closed_requests
+            nb_connections = self.closed_connections
+            for pool in pools._container.values():
+                nb_requests += pool.num_requests
+                nb_connections += pool.num_connections
+        return {"requests": nb_requests,
+                "connections": nb_connections,
+                "reused": max(nb_requests - nb_connections, 0)}
+
+    def format_stats(self):
+        """Format connection reuse statistics.
+
+        Returns
+        -------
+        str
+            Return the formatted statistics string.
+
+        """
+        stats = self.stats()
+        return self.stats_fmt.format(stats["requests"],
+                                     stats["connections"],
+                                     stats["reused"])
+
+    def close(self):
+        """Close every connection kept alive by the session."""
+        self.session.close()
@@ -10,6 +10,9 @@ setup(name='fbscraper',
       author_email='elcoco@protonmail.ch',
       license='MIT',
       packages=['fbscraper'],
+      extras_require={
+        'async': ['aiohttp']
+      },
       entry_points={
         'console_scripts': [
             'fbscraper = fbscraper.__main__:main'